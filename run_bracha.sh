@@ -0,0 +1,5 @@
+NUM_NODES=10
+python3 src/topology.py $NUM_NODES topologies/communication.yaml bracha --family file
+python3 src/analyze.py topologies/communication.yaml bracha || exit 1
+docker-compose build
+docker-compose up
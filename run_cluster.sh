@@ -1,7 +1,8 @@
 #!/bin/bash
 
 NUM_NODES=15
+python3 src/analyze.py topologies/cluster.yaml cluster || exit 1
 python3 src/run.py $NUM_NODES topologies/cluster.yaml cluster
-#python3 src/util.py $NUM_NODES topologies/election.yaml dolev
+#python3 src/topology.py $NUM_NODES topologies/election.yaml dolev
 docker-compose build
 docker-compose up
@@ -1,5 +1,6 @@
 
 NUM_NODES=6
-python3 src/util_connected.py $NUM_NODES topologies/connected.yaml dolev
+python3 src/topology.py $NUM_NODES topologies/connected.yaml dolev --family complete
+python3 src/analyze.py topologies/connected.yaml dolev || exit 1
 docker-compose build
 docker-compose up
@@ -1,6 +1,7 @@
 
 NUM_NODES=6
-python3 src/util_communication.py $NUM_NODES topologies/communication.yaml dolev
-#python3 src/util.py $NUM_NODES topologies/election.yaml dolev
+python3 src/topology.py $NUM_NODES topologies/communication.yaml dolev --family file
+python3 src/analyze.py topologies/communication.yaml dolev || exit 1
+#python3 src/topology.py $NUM_NODES topologies/election.yaml dolev
 docker-compose build
 docker-compose up
@@ -1,5 +1,6 @@
 
 NUM_NODES=2
-python3 src/util.py $NUM_NODES topologies/echo.yaml echo
+python3 src/topology.py $NUM_NODES topologies/echo.yaml echo
+python3 src/analyze.py topologies/echo.yaml echo || exit 1
 docker-compose build
 docker-compose up
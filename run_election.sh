@@ -1,5 +1,6 @@
 
 NUM_NODES=5
-python3 src/util.py $NUM_NODES topologies/election.yaml dolev
+python3 src/topology.py $NUM_NODES topologies/election.yaml election
+python3 src/analyze.py topologies/election.yaml election || exit 1
 docker-compose build
 docker-compose up
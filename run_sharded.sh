@@ -0,0 +1,5 @@
+#!/bin/bash
+
+# All nodes on this machine, packed into one process per core instead of one container per node
+python3 src/analyze.py topologies/cluster.yaml cluster || exit 1
+python3 src/run.py --workers 0 topologies/cluster.yaml cluster
@@ -40,6 +40,6 @@ class EchoAlgorithm(DistributedAlgorithm):
         if self.echo_counter >= self.max_echo_count:
             print(f'Node {self.node_id} is stopping')
             self.stop()
-        print(f'[Node {self.node_id}] Got a message from node: {sender_id}.\t current counter: {self.echo_counter}')
+        self.debug('[Node %d] Got a message from node: %s.\t current counter: %d', self.node_id, sender_id, self.echo_counter)
         # Then synchronize with the rest of the network again.
         self.ez_send(peer, MyMessage(self.echo_counter))
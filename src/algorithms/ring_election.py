@@ -1,6 +1,3 @@
-import asyncio
-import random
-
 from ipv8.community import CommunitySettings
 from ipv8.messaging.payload_dataclass import overwrite_dataclass
 from dataclasses import dataclass
@@ -43,7 +40,8 @@ class RingElection(DistributedAlgorithm):
         self.add_message_handler(TerminationMessage, self.on_terminate)
 
     async def on_start(self):
-        await asyncio.sleep(random.uniform(1.0, 3.0))
+        await self.sleep(self.random.uniform(1.0, 3.0))
+        self.record_broadcast("election")
         if not self.running:
             peer = list(self.nodes.values())[0]
             print(f'[Node {self.node_id}] Starting by selecting a node: {self.node_id_from_peer(peer)}')
@@ -52,6 +50,7 @@ class RingElection(DistributedAlgorithm):
     @message_wrapper(TerminationMessage)
     async def on_terminate(self, peer: Peer, _: TerminationMessage) -> None:
         if self.running:
+            self.record_delivery("election")
             _next_node_id, next_peer = [x for x in self.nodes.items() if x[1] != peer][0]
             self.ez_send(next_peer, TerminationMessage())
             self.running = False
@@ -62,7 +61,7 @@ class RingElection(DistributedAlgorithm):
         self.running = True
         # Sending it around the ring to the other peer we received it from.
         next_node_id, next_peer = [x for x in self.nodes.items() if x[1] != peer][0]
-        print(f'[Node {self.node_id}] Got a message from with elector id: {payload.elector}')
+        self.debug('[Node %d] Got a message from with elector id: %d', self.node_id, payload.elector)
 
         received_id = payload.elector
 
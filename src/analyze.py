@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import yaml
+
+from topology import Topology, disjoint_paths, vertex_connectivity_at_least
+
+CACHE_DIR = ".cache/analyze"
+# above this many nodes the disjoint paths are counted for a sample of the pairs
+MAX_ALL_PAIRS = 30
+SAMPLE_PAIRS = 100
+
+
+def load_topology(topology_file: str) -> Topology:
+    # files can list a connection on one side only, the nodes connect both ways
+    with open(topology_file, "r") as f:
+        content = yaml.safe_load(f)
+    neighbours = {int(node_id): set() for node_id in content}
+    for node_id, connections in content.items():
+        for other in connections:
+            if other != node_id:
+                neighbours[int(node_id)].add(other)
+                neighbours.setdefault(other, set()).add(int(node_id))
+    return {node_id: sorted(x) for node_id, x in neighbours.items()}
+
+
+def vertex_connectivity(topology: Topology) -> int:
+    k = 0
+    while vertex_connectivity_at_least(topology, k + 1):
+        k += 1
+    return k
+
+
+def pair_paths(topology: Topology, connectivity: int) -> Dict:
+    """
+    Amount of node-disjoint paths between pairs of nodes: for all pairs of small
+    topologies, a (seeded) sample of them for large ones. It is at least the vertex
+    connectivity and at most the lowest degree of the pair, when those are the same
+    there is nothing to count.
+    """
+    nodes = sorted(topology)
+    if len(nodes) <= MAX_ALL_PAIRS:
+        pairs = [(a, b) for i, a in enumerate(nodes) for b in nodes[i + 1:]]
+    else:
+        rng = random.Random(0)
+        pairs = [tuple(rng.sample(nodes, 2)) for _ in range(SAMPLE_PAIRS)]
+    counts = []
+    for a, b in pairs:
+        most = min(len(topology[a]), len(topology[b]))
+        counts.append(connectivity if most == connectivity else disjoint_paths(topology, a, {b}, most))
+    if not counts:
+        return {"pairs": 0, "min": None, "mean": None, "max": None, "sampled": False}
+    return {
+        "pairs": len(pairs),
+        "min": min(counts),
+        "mean": sum(counts) / len(counts),
+        "max": max(counts),
+        "sampled": len(nodes) > MAX_ALL_PAIRS,
+    }
+
+
+def elected_heads(topology: Topology, max_cluster_size: int) -> Dict[int, List[int]]:
+    """
+    The heads and their members ClusterHeadAlgorithm.elect comes to, when the joins
+    reach the heads heaviest node first (the order in which the nodes decide).
+    """
+    def key(node_id: int) -> Tuple[int, int]:
+        return min(len(topology[node_id]), max_cluster_size - 1), -node_id
+
+    members: Dict[int, List[int]] = {}
+    for node_id in sorted(topology, key=key, reverse=True):
+        heads = [
+            x for x in topology[node_id]
+            if x in members and len(members[x]) + 1 < max_cluster_size and key(x) > key(node_id)
+        ]
+        if heads:
+            members[max(heads, key=key)].append(node_id)
+        else:
+            members[node_id] = []
+    return members
+
+
+def cluster_reachability(topology: Topology, heads: Sequence[int], messages: Sequence[Tuple[int, int]],
+                         members: Optional[Dict[int, List[int]]] = None) -> Dict:
+    """
+    What ClusterHeadAlgorithm can route with these heads: a head knows its members (all
+    its neighbours with fixed heads), a node next to two or more heads becomes a gateway
+    between them, and heads learn the clusters of every head they are connected to
+    through gateways.
+    """
+    heads = [x for x in heads if x in topology]
+    head_set = set(heads)
+    # node -> the heads a message from it can go to first
+    first_heads = {
+        node_id: [node_id] if node_id in head_set else [x for x in connections if x in head_set]
+        for node_id, connections in topology.items()
+    }
+    gateways = sorted(x for x, connections in topology.items() if sum(1 for y in connections if y in head_set) > 1)
+
+    # heads connected through gateways end up in the same group
+    group = {head: head for head in heads}
+
+    def find(head: int) -> int:
+        while group[head] != head:
+            group[head] = group[group[head]]
+            head = group[head]
+        return head
+
+    for gateway in gateways:
+        connected = [x for x in [gateway, *topology[gateway]] if x in head_set]
+        for head in connected[1:]:
+            group[find(head)] = find(connected[0])
+
+    # group -> the nodes its heads know a route to
+    known: Dict[int, set] = {}
+    for head in heads:
+        known.setdefault(find(head), set()).update(topology[head] if members is None else members[head], [head])
+
+    def reachable(sender: int, destination: int) -> bool:
+        if sender == destination:
+            return True
+        # a node sends to whichever of its heads said hello first, so all of them have to know the way
+        return bool(first_heads.get(sender)) and all(
+            destination in known[find(head)] for head in first_heads[sender]
+        )
+
+    groups: Dict[int, List[int]] = {}
+    for head in heads:
+        groups.setdefault(find(head), []).append(head)
+    return {
+        "heads": heads,
+        "uncovered": sorted(x for x, first in first_heads.items() if not first),
+        "gateways": gateways,
+        "groups": sorted(groups.values()),
+        "messages": [[sender, destination, reachable(sender, destination)] for sender, destination in messages],
+    }
+
+
+def analyze(topology: Topology, heads: Sequence[int] = (), messages: Sequence[Tuple[int, int]] = (),
+            members: Optional[Dict[int, List[int]]] = None) -> Dict:
+    connectivity = vertex_connectivity(topology)
+    report = {
+        "nodes": len(topology),
+        "edges": sum(len(x) for x in topology.values()) // 2,
+        "min_degree": min((len(x) for x in topology.values()), default=0),
+        "connectivity": connectivity,
+        "paths": pair_paths(topology, connectivity),
+    }
+    if heads:
+        report["clusters"] = cluster_reachability(topology, heads, messages, members)
+    return report
+
+
+def cached_analyze(topology: Topology, heads: Sequence[int] = (), messages: Sequence[Tuple[int, int]] = (),
+                   members: Optional[Dict[int, List[int]]] = None, cache_dir: Optional[str] = CACHE_DIR) -> Dict:
+    """
+    analyze(), with the report stored under the hash of its input, so unchanged
+    topologies are only analyzed once.
+    """
+    key = json.dumps(
+        {"topology": sorted(topology.items()), "heads": list(heads), "messages": [list(x) for x in messages],
+         "members": sorted(members.items()) if members is not None else None}
+    )
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".json")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                return json.load(f)
+
+    report = analyze(topology, heads, messages, members)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f)
+    return report
+
+
+def problems(report: Dict, algorithm_name: str, f: int, expected_unreachable: Sequence[bool] = ()) -> List[str]:
+    # reasons the algorithm cannot work on the analyzed topology, empty when it can
+    found = []
+    if report["connectivity"] == 0 and algorithm_name != "cluster":
+        found.append("the topology is not connected")
+
+    if algorithm_name in ("dolev", "bracha") and report["connectivity"] < 2 * f + 1:
+        found.append(f"vertex connectivity is {report['connectivity']}, tolerating f={f} takes {2 * f + 1}")
+    if algorithm_name == "bracha" and report["nodes"] < 3 * f + 1:
+        found.append(f"{report['nodes']} nodes, tolerating f={f} takes {3 * f + 1}")
+    if algorithm_name == "election" and (report["min_degree"] != 2 or report["edges"] != report["nodes"]
+                                         or report["connectivity"] < 2):
+        found.append("the ring election needs a ring")
+
+    clusters = report.get("clusters")
+    if algorithm_name == "cluster":
+        if clusters is None or not clusters["heads"]:
+            found.append("there are no cluster heads in the topology")
+        else:
+            if clusters["uncovered"]:
+                found.append(f"nodes {clusters['uncovered']} are not next to any cluster head")
+            for i, (sender, destination, reachable) in enumerate(clusters["messages"]):
+                expected = not (i < len(expected_unreachable) and expected_unreachable[i])
+                if reachable != expected:
+                    found.append(f"message {sender} to {destination} {'cannot' if expected else 'should not'} arrive")
+    return found
+
+
+def print_report(report: Dict) -> None:
+    print(f"{report['nodes']} nodes, {report['edges']} edges, min degree {report['min_degree']}")
+    print(f"Vertex connectivity: {report['connectivity']}")
+    paths = report["paths"]
+    if paths["pairs"]:
+        print(f"Disjoint paths over {paths['pairs']}{' sampled' if paths['sampled'] else ''} pairs: "
+              f"min {paths['min']}, mean {paths['mean']:.2f}, max {paths['max']}")
+    clusters = report.get("clusters")
+    if clusters:
+        print(f"Cluster heads {clusters['heads']}, gateways {clusters['gateways']}, "
+              f"connected head groups {clusters['groups']}")
+        for sender, destination, reachable in clusters["messages"]:
+            print(f"  {sender} -> {destination}: {'reachable' if reachable else 'unreachable'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Topology analyzer",
+        description="Check that a topology can support an algorithm before running it.",
+    )
+    parser.add_argument("topology_file", type=str)
+    parser.add_argument("algorithm", type=str)
+    parser.add_argument("-f", type=int, default=None, help="faulty nodes to tolerate, the algorithm's f by default")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    # imported here, the algorithms pull in ipv8
+    from run import get_algorithm
+    from cluster import ClusterHeadAlgorithm
+
+    algorithm = get_algorithm(args.algorithm)
+    f = args.f if args.f is not None else getattr(algorithm, "f", 0)
+    heads, messages, expected_unreachable, members = [], [], [], None
+    topology = load_topology(args.topology_file)
+    if issubclass(algorithm, ClusterHeadAlgorithm):
+        heads = ClusterHeadAlgorithm.cluster_heads
+        if ClusterHeadAlgorithm.elect_heads:
+            members = elected_heads(topology, ClusterHeadAlgorithm.max_cluster_size)
+            heads = sorted(members)
+        cluster_messages = algorithm.messages_for(args.topology_file)
+        messages = [(x.sender, x.destination) for x in cluster_messages]
+        expected_unreachable = ["should not arrive" in x.data for x in cluster_messages]
+
+    report = cached_analyze(topology, heads, messages, members, None if args.no_cache else CACHE_DIR)
+    print_report(report)
+
+    found = problems(report, args.algorithm, f, expected_unreachable)
+    for problem in found:
+        print(f"\033[31m{args.topology_file} cannot run {args.algorithm}: {problem}\033[0m")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,208 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import math
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+import yaml
+
+from da_types import LOG_QUIET
+from run import algorithms
+from simulation import run_simulation
+
+# class attributes a benchmark run sets on the algorithm
+SETTINGS = ("num_nodes", "seed", "log_level")
+
+# metrics compared between two results files, and whether higher is better
+METRICS = {
+    "messages": False,
+    "bytes": False,
+    "datagrams": False,
+    "deliveries": True,
+    "convergence": False,
+    "p50": False,
+    "p99": False,
+}
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    # nearest-rank percentile
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def benchmark(algorithm_name: str, topology_file: str, seed: int, duration: float) -> Dict:
+    """
+    Simulate one algorithm on one topology in virtual time and collect its measurements.
+    Times are virtual seconds since the start of the simulation. A run that raised,
+    or in which none of the broadcasts was delivered, has its reason in error.
+    """
+    with open(topology_file, "r") as f:
+        topology = yaml.safe_load(f)
+
+    algorithm = algorithms[algorithm_name]
+    # the settings are shared with every other user of the class, so they are put back afterwards
+    saved = {name: vars(algorithm)[name] for name in SETTINGS if name in vars(algorithm)}
+    algorithm.num_nodes = len(topology)
+    algorithm.seed = seed
+    algorithm.log_level = LOG_QUIET
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            nodes = run_simulation(topology, algorithm, duration)
+    except Exception as e:
+        # an algorithm that does not fit a topology can raise, the other runs go on
+        return {"algorithm": algorithm_name, "topology": topology_file, "seed": seed,
+                "error": f"{type(e).__name__}: {e}"}
+    finally:
+        for name in SETTINGS:
+            if name in saved:
+                setattr(algorithm, name, saved[name])
+            elif name in vars(algorithm):
+                delattr(algorithm, name)
+
+    started = {}
+    for node in nodes.values():
+        for key, time in node.metrics.broadcasts.items():
+            started[key] = min(time, started.get(key, time))
+
+    latencies = []
+    last_delivery = {}
+    for node_id, node in nodes.items():
+        for key, time in node.metrics.deliveries.items():
+            if key in started:
+                latencies.append(time - started[key])
+        if node.metrics.deliveries:
+            last_delivery[node_id] = max(node.metrics.deliveries.values())
+
+    convergence = None
+    if started and last_delivery:
+        convergence = max(last_delivery.values()) - min(started.values())
+
+    deliveries = sum(len(node.metrics.deliveries) for node in nodes.values())
+    return {
+        "algorithm": algorithm_name,
+        "topology": topology_file,
+        "seed": seed,
+        "nodes": len(nodes),
+        "messages": sum(sum(node.metrics.sent.values()) for node in nodes.values()),
+        "bytes": sum(sum(node.metrics.bytes_sent.values()) for node in nodes.values()),
+        "datagrams": sum(node.metrics.datagrams for node in nodes.values()),
+        "deliveries": deliveries,
+        "convergence": convergence,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        # per node, the time of its last delivery
+        "node_delivery": last_delivery,
+        # algorithms like echo do not broadcast, so they do not deliver either
+        "error": "nothing delivered" if started and not deliveries else None,
+    }
+
+
+def summarize(runs: List[Dict]) -> Dict[str, Dict]:
+    # mean of every metric over the seeds that worked, per algorithm and topology
+    grouped = {}
+    for result in runs:
+        grouped.setdefault(f"{result['algorithm']} {result['topology']}", []).append(result)
+
+    summary = {}
+    for name, results in grouped.items():
+        ok = [result for result in results if not result.get("error")]
+        summary[name] = {
+            "runs": len(results),
+            "failed": len(results) - len(ok),
+            "errors": sorted({result["error"] for result in results if result.get("error")}),
+        }
+        for metric in METRICS:
+            values = [result[metric] for result in ok if result[metric] is not None]
+            summary[name][metric] = sum(values) / len(values) if values else None
+    return summary
+
+
+def compare(old_file: str, new_file: str, threshold: float) -> int:
+    """
+    Print the metrics that got worse by more than threshold (relative), returns the amount.
+    More failed runs for a combination count as a regression as well.
+    """
+    with open(old_file, "r") as f:
+        old = json.load(f)
+    with open(new_file, "r") as f:
+        new = json.load(f)
+    print(f"Comparing {old.get('commit')} to {new.get('commit')}")
+
+    regressions = 0
+    for name, metrics in sorted(new["summary"].items()):
+        if name not in old["summary"]:
+            print(f"{name}: new")
+            continue
+        before, after = old["summary"][name].get("failed", 0), metrics.get("failed", 0)
+        if after > before:
+            regressions += 1
+            print(f"\033[31mREGRESSION {name}: {after} of {metrics['runs']} runs failed, was {before} "
+                  f"({', '.join(metrics['errors'])})\033[0m")
+        elif after < before:
+            print(f"{name}: {after} of {metrics['runs']} runs failed, was {before}")
+        for metric, higher_is_better in METRICS.items():
+            before, after = old["summary"][name][metric], metrics[metric]
+            if before is None or after is None:
+                if (before is None) != (after is None):
+                    print(f"{name} {metric}: {before} -> {after}")
+                continue
+            change = (after - before) / before if before else (0.0 if after == before else math.inf)
+            worse = -change if higher_is_better else change
+            if worse > threshold:
+                regressions += 1
+                print(f"\033[31mREGRESSION {name} {metric}: {before:.4g} -> {after:.4g} ({change:+.1%})\033[0m")
+            elif -worse > threshold:
+                print(f"{name} {metric}: {before:.4g} -> {after:.4g} ({change:+.1%})")
+    print(f"{regressions} regressions")
+    return regressions
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Benchmarks",
+        description="Run every algorithm on every topology in virtual time and record its cost.",
+    )
+    parser.add_argument("-a", "--algorithms", nargs="+", default=list(algorithms), choices=list(algorithms))
+    parser.add_argument("-t", "--topologies", nargs="+", default=sorted(glob.glob("topologies/*.yaml")))
+    parser.add_argument("-s", "--seeds", type=int, default=3, help="amount of seeds to run every combination with")
+    parser.add_argument("-d", "--duration", type=float, default=60.0, help="virtual seconds per run")
+    parser.add_argument("-o", "--output", type=str, default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files instead")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    runs = []
+    for algorithm_name in args.algorithms:
+        for topology_file in args.topologies:
+            for seed in range(args.seeds):
+                result = benchmark(algorithm_name, topology_file, seed, args.duration)
+                runs.append(result)
+                if "messages" not in result:
+                    print(f"\033[31m{algorithm_name} {topology_file} seed {seed}: {result['error']}\033[0m")
+                    continue
+                print(f"{algorithm_name} {topology_file} seed {seed}: {result['messages']} messages, "
+                      f"{result['bytes']} bytes, {result['deliveries']} deliveries, p99 {result['p99']}"
+                      + (f" ({result['error']})" if result["error"] else ""))
+
+    with open(args.output, "w") as f:
+        json.dump({"commit": current_commit(), "runs": runs, "summary": summarize(runs)}, f, indent=1)
+    print(f"Output written to {args.output}")
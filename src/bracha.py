@@ -0,0 +1,123 @@
+import json
+from functools import lru_cache
+
+from ipv8.community import CommunitySettings
+
+from dolev import Dolev
+
+
+KINDS = ("send", "echo", "ready")
+
+
+@lru_cache(maxsize=1024)
+def parse_batch(message):
+    """
+    The (kind, source, seq, content) entries of a batch, as a tuple as the result is cached
+    and shared. Byzantine nodes can send anything, a batch that is not a list of such entries
+    has none.
+    """
+    # the same batch is looked at for every neighbour it is relayed to
+    try:
+        entries = json.loads(message)
+    except (TypeError, ValueError):
+        return ()
+    if not isinstance(entries, list):
+        return ()
+    for entry in entries:
+        if not (isinstance(entry, list) and len(entry) == 4 and entry[0] in KINDS
+                and all(type(x) is int for x in entry[1:3]) and isinstance(entry[3], str)):
+            return ()
+    return tuple(tuple(entry) for entry in entries)
+
+
+class BrachaDolev(Dolev):
+    """
+    Bracha's authenticated double echo broadcast, using Dolev as transport.
+    Every SEND, ECHO and READY is Dolev broadcast, so the network only has to be
+    2f+1 connected instead of fully connected.
+
+    ECHO and READY messages produced within batch_window of each other
+    (for any amount of broadcasts) are sent as a single Dolev broadcast.
+    """
+
+    # total amount of nodes in the network, set from the topology by run.py
+    num_nodes = 0
+
+    # seconds to wait for more echo/ready messages before sending a batch
+    batch_window = 0.5
+
+    def __init__(self, settings: CommunitySettings) -> None:
+        super().__init__(settings)
+
+        self.pending = []
+        self.brb_seq = 0
+
+        # per broadcast (source, seq, message) the nodes that sent an echo/ready,
+        # counted per message so a byzantine source can not mix two of them
+        self.echoes = {}
+        self.readies = {}
+
+        self.sent_echo = set()
+        self.sent_ready = set()
+        self.brb_delivered = set()
+
+    async def on_start(self):
+        # check if this node has a message to brodcast
+        if self.node_id in Dolev.messages.keys():
+            self.brb_seq += 1
+            self.record_broadcast((self.node_id, Dolev.messages[self.node_id]))
+            self.queue("send", self.node_id, self.brb_seq, Dolev.messages[self.node_id])
+
+    def echo_threshold(self):
+        return (self.num_nodes + self.f + 2) // 2
+
+    def queue(self, kind, source, seq, message):
+        self.pending.append([kind, source, seq, message])
+        self.metrics.gauge("pending", len(self.pending))
+        if len(self.pending) == 1:
+            self.register_anonymous_task("flush_batch", self.flush, delay=BrachaDolev.batch_window)
+
+    def flush(self):
+        entries, self.pending = self.pending, []
+        self.broadcast(json.dumps(entries))
+
+    def deliver(self, origin, message):
+        for kind, source, seq, content in parse_batch(message):
+            key = (source, seq)
+            vote = (source, seq, content)
+
+            if kind == "send":
+                # only the source itself can start a broadcast
+                # a node that already sent ready does not need to echo anymore
+                if origin == source and key not in self.sent_echo and key not in self.sent_ready:
+                    self.sent_echo.add(key)
+                    self.queue("echo", source, seq, content)
+            elif kind == "echo":
+                self.echoes.setdefault(vote, set()).add(origin)
+            elif kind == "ready":
+                self.readies.setdefault(vote, set()).add(origin)
+
+            self.check(vote)
+
+    def check(self, vote):
+        source, seq, content = vote
+        key = (source, seq)
+        echoes = len(self.echoes.get(vote, ()))
+        readies = len(self.readies.get(vote, ()))
+
+        # enough echoes, or enough readies to know a correct node sent one
+        if key not in self.sent_ready and (echoes >= self.echo_threshold() or readies >= self.f + 1):
+            self.sent_ready.add(key)
+            self.queue("ready", source, seq, content)
+
+        if key not in self.brb_delivered and readies >= 2 * self.f + 1:
+            self.brb_delivered.add(key)
+            self.record_delivery((source, content))
+            self.info("Message \"%s\" has been reliably delivered from node %d.", content, source)
+
+    def should_relay(self, neighbour_id, origin, message):
+        # a neighbour that already sent ready has no use for echoes anymore
+        for kind, source, seq, content in parse_batch(message):
+            if kind != "echo" or neighbour_id not in self.readies.get((source, seq, content), ()):
+                return True
+        return False
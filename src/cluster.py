@@ -1,7 +1,7 @@
 import string
 import json
-import random
 import asyncio
+import os
 
 from ipv8.community import CommunitySettings
 from ipv8.messaging.payload_dataclass import overwrite_dataclass
@@ -10,6 +10,8 @@ from dataclasses import dataclass
 from ipv8.types import Peer
 
 from da_types import DistributedAlgorithm, message_wrapper
+from reliable import ReliableLink
+from routing import RoutingTable, bloom, decode_adverts, decode_ids, encode_ids, mix
 
 # We are using a custom dataclass implementation
 dataclass = overwrite_dataclass(dataclass)
@@ -34,89 +36,143 @@ class DataMessage:
 )
 class GatewayAck:
     gateway_id: int
+    heads: bytes    # varint ids of the heads the gateway connects, see routing.encode_ids
 
 @dataclass(
-    msg_id=4
+    msg_id=5
+)
+class RoutingUpdate:
+    sender: int
+    adverts: bytes    # only the adverts that changed, see routing.encode_adverts
+
+@dataclass(
+    msg_id=6
+)
+class HeadWeight:
+    node_id: int
+    weight: int
+
+@dataclass(
+    msg_id=7
+)
+class HeadDecision:
+    node_id: int
+    cluster_head: int    # the node itself when it became a head
+
+@dataclass(
+    msg_id=8
 )
-class AdvertiseNeighbours:
+class JoinCluster:
+    node_id: int
+
+@dataclass(
+    msg_id=9
+)
+class JoinReply:
     cluster_head: int
-    neighbours: str
+    accepted: bool
 
 @dataclass(
-    msg_id=5
+    msg_id=10
 )
-class RoutingUpdate:
+class GatewayRole:
+    cluster_head: int
+    selected: bool
+
+@dataclass(
+    msg_id=11
+)
+class SummaryData:
+    head: int    # the head whose summary has the destination, see forward
+    tried: bytes    # varint ids of the heads whose summary turned out not to have it
     sender: int
-    routing_table: str
+    destination: int
+    data: str
 
-class ClusterHeadAlgorithm(DistributedAlgorithm):
-    cluster_heads = []
-    messages = []
-
-    topology = "many_ch"
-
-    if topology == "cluster_dense":
-        # Cluster heads for the cluster_dense topology
-        cluster_heads = [0, 7, 8]
-        messages = [
-            DataMessage(1, 9, "Testcase RR: 1 to 9"),
-            DataMessage(5, 6, "Testcase RG: 5 to 6"),
-            DataMessage(4, 8, "Testcase RC: 4 to 8"),
-            DataMessage(6, 5, "Testcase GR: 6 to 5"),
-            DataMessage(6, 6, "Testcase GG: 6 to 6"),
-            DataMessage(6, 8, "Testcase GC: 6 to 8"),
-            DataMessage(4, 6, "Testcase CG: 4 to 6"),
-            DataMessage(0, 8, "Testcase CR: 0 to 8"),
-            DataMessage(0, 4, "Testcase CC: 0 to 4"),
-        ]
+@dataclass(
+    msg_id=12
+)
+class HopData:
+    seq: int
+    base: int    # lowest sequence number the sender still sends, see reliable.ReliableLink
+    head: int    # -1 for a DataMessage, the rest are its fields or those of a SummaryData
+    tried: bytes
+    sender: int
+    destination: int
+    data: str
 
-    elif topology == "cluster_disconnected":
-        cluster_heads = [0, 3, 7, 10, 12]
-        messages = [
-            DataMessage(5, 1, "Testcase RR: 5 to 1"),
-            DataMessage(13, 9, "Testcase RG: 13 to 9"),
-            DataMessage(11, 12, "Testcase RC: 1 to 12"),
-            DataMessage(2, 4, "Testcase GR: 2 to 4"),
-            DataMessage(2, 0, "Testcase GC: 2 to 0"),
-            DataMessage(9, 12, "Testcase CG: 9 to 12"),
-            DataMessage(0, 6, "Testcase CR: 0 to 6"),
-            DataMessage(3, 0, "Testcase CC: 3 to 0"),
+@dataclass(
+    msg_id=13
+)
+class HopAck:
+    cumulative: int    # lowest sequence number not received yet
+    seq: int    # the one this ack is sent for
 
+class ClusterHeadAlgorithm(DistributedAlgorithm):
+    # elect the cluster heads (see elect), instead of using the fixed cluster_heads below
+    elect_heads = True
+    # most nodes in an elected cluster, its head included
+    max_cluster_size = 8
+    # seconds to wait for the election, after that a node that did not decide becomes a head
+    election_timeout = 5.0
+    # gateways a head keeps per neighbouring head, the others are demoted to ordinary members
+    gateways_per_pair = 1
+    # levels of clusters, the heads of one level elect those of the level above (see update_hierarchy), 1 is flat
+    levels = 1
+    # hops from a level 2 head to the heads of its clusters, doubling every level up
+    cluster_radius = 4
+    # bits of the Bloom filter summaries of all nodes in the clusters of heads of level 2 and up,
+    # needed with levels > 1. The same on all nodes, as summaries are merged with |.
+    # About 10 bits per node keeps false positives near 1%.
+    summary_bits = 1024
+    summary_hashes = 4
+    # data messages to a neighbour that can wait for an ack at a time (see send_data), 0 sends them without acks
+    reliable_window = 0
+    # times a data message is sent again before it is given up
+    max_retransmits = 8
+    # seconds a head has to be the heaviest near it before it becomes a head of the level above,
+    # for the adverts of heavier heads to arrive
+    hierarchy_timeout = 5.0
+    # seconds a router keeps a message it has no route for yet, as the routes may still be on their way
+    route_timeout = 30.0
+
+    # the cluster heads when elect_heads is off, with it on the heads come from the election
+    cluster_heads = []
+    # sent once the routes are set up, a message with "should not arrive" in its data is expected
+    # to have no route (see analyze.py)
+    messages = [
+        DataMessage(0, 5, "Message 0 to 5"),
+        DataMessage(3, 0, "Message 3 to 0"),
+        DataMessage(2, 5, "Message 2 to 5"),
+    ]
+    # the messages for a topology instead, by the name of its file (see messages_for)
+    topology_messages = {
+        "cluster_disconnected": [
+            DataMessage(5, 1, "Message 5 to 1"),
+            DataMessage(13, 9, "Message 13 to 9"),
+            DataMessage(11, 12, "Message 11 to 12"),
+            DataMessage(2, 4, "Message 2 to 4"),
+            DataMessage(3, 0, "Message 3 to 0"),
+            # nodes 0 to 6 and 7 to 14 are not connected
             DataMessage(0, 7, "This message should not arrive"),
             DataMessage(2, 12, "This message should not arrive"),
             DataMessage(14, 6, "This message should not arrive"),
-        ]
+        ],
+    }
 
-    elif topology == "cluster_string":
-        # Cluster heads and messages for the cluster_string topology
-        cluster_heads = [0, 3, 6, 9]
-        messages = [
-            DataMessage(1, 7, "Testcase RR: 1 to 7"),
-            DataMessage(1, 8, "Testcase RG: 1 to 8"),
-            DataMessage(1, 9, "Testcase RC: 1 to 9"),
-            DataMessage(5, 4, "Testcase GR: 5 to 4"),
-            DataMessage(8, 2, "Testcase GG: 8 to 7"),
-            DataMessage(5, 0, "Testcase GC: 5 to 0"),
-            DataMessage(3, 8, "Testcase CG: 3 to 8"),
-            DataMessage(3, 10, "Testcase CR: 3 to 10"),
-            DataMessage(0, 6, "Testcase CC: 0 to 6"),
-        ]
-
-    elif topology == "many_ch":
-        # Cluster heads for the many_ch
-        cluster_heads = [1, 2, 3, 4, 5]
-        messages = [
-            DataMessage(0, 5, "Testcase GC: 0 to 5"),
-            DataMessage(3, 0, "Testcase CG: 3 to 0"),
-            DataMessage(2, 5, "Testcase CC: 2 to 5"),
-        ]
-        
-    else:
-        print("\033[31mUnrecognised topology\033[31m")
+    # seconds to collect routing changes before sending one merged update per neighbour
+    update_window = 0.5
 
+    @classmethod
+    def messages_for(cls, topology_file):
+        # the messages to send on the topology in this file
+        name = os.path.splitext(os.path.basename(topology_file))[0]
+        return cls.topology_messages.get(name, cls.messages)
 
     def __init__(self, settings: CommunitySettings) -> None:
         super().__init__(settings)
+        if ClusterHeadAlgorithm.levels > 1 and not ClusterHeadAlgorithm.summary_bits:
+            raise ValueError("levels > 1 needs summary_bits, the higher levels summarize the nodes of their clusters")
 
         self.printing_suffix = ""
         self.is_cluster_head = False
@@ -125,212 +181,607 @@ class ClusterHeadAlgorithm(DistributedAlgorithm):
         self.connected_heads = []
         self.connected_gateways = []
 
-        self.routing_table = {}
+        # gateway pruning, see select_gateways
+        self.gateway_heads = {}
+        self.gateway_peers = {}
+        self.selected_by = set()
+
+        self.routing_table = RoutingTable(ClusterHeadAlgorithm.summary_bits, ClusterHeadAlgorithm.summary_hashes)
+        # highest level we are a cluster head of, see update_hierarchy
+        self.level = 0
+        # level -> since when we elect the heads of that level, and when we last changed our advert
+        # of it, see update_hierarchy
+        self.electing = {}
+        self.advertised = {}
+        # level -> when we last joined a head of that level, and the (level, head)s that did not list
+        # us in time, as they do not get our adverts
+        self.joined = {}
+        self.unheard = set()
+
+        # head election, see elect
+        self.cluster_head = None
+        self.members = set()
+        self.weights = {}
+        self.decisions = {}
+        self.rejected = set()
+        self.joining = None
+        self.elected = asyncio.Event()
+
+        # neighbour id -> origins of the adverts it still has to be sent (None for all of them)
+        self.dirty = {}
+        self.ru_sent = 0
+        self.ru_suppressed = 0
+        # messages that reached us through our summary, but are not for our clusters
+        self.false_positives = 0
+        # (deadline, payload, tried, head) of the messages waiting for a route, see hold
+        self.held = []
+
+        # neighbour id -> sequence numbers and acks of the data messages to and from it, see send_data
+        self.links = {}
+        self.retransmit_at = None
 
         # Make sure the register the message handlers for each message type
         self.add_message_handler(ClusterHello, self.on_hello)
         self.add_message_handler(GatewayAck, self.on_gateway_ack)
-        self.add_message_handler(AdvertiseNeighbours, self.on_advertise_neighbours)
+        self.add_message_handler(GatewayRole, self.on_gateway_role)
         self.add_message_handler(RoutingUpdate, self.on_routing_update)
         self.add_message_handler(DataMessage, self.on_data_message)
+        self.add_message_handler(SummaryData, self.on_summary_data)
+        self.add_message_handler(HopData, self.on_hop_data)
+        self.add_message_handler(HopAck, self.on_hop_ack)
+        self.add_message_handler(HeadWeight, self.on_head_weight)
+        self.add_message_handler(HeadDecision, self.on_head_decision)
+        self.add_message_handler(JoinCluster, self.on_join_cluster)
+        self.add_message_handler(JoinReply, self.on_join_reply)
 
     async def on_start(self):
-        self.is_cluster_head = self.node_id in ClusterHeadAlgorithm.cluster_heads
+        if ClusterHeadAlgorithm.elect_heads:
+            await self.elect()
+            self.is_cluster_head = self.cluster_head == self.node_id
+        else:
+            self.is_cluster_head = self.node_id in ClusterHeadAlgorithm.cluster_heads
         self.printing_suffix = f"__ {self.node_id}"
         if self.is_cluster_head:
             self.printing_suffix = f"CH {self.node_id}"
-            
-        # await asyncio.sleep(random.uniform(1.0, 3.0))
-        #self.routing_table[self.node_id] = set([x[0] for x in self.nodes.items()])
-
 
         if self.is_cluster_head:
             # Send ping message to determine gateways -> when node receives more than 2 pings it becomes a gateway
             peers = [x for x in self.nodes.items()]
-            # print(f"{self.node_id}: I am a cluster head and sending hello to {[id._next_node_id for id in peers]}")
             
             # As a cluster head we want to initialise our routing table with all nodes in our cluster
-            self.routing_table[self.node_id] = set([x[0] for x in self.nodes.items()])
-            print(f"{self.printing_suffix}: Initial routing table: {self.routing_table}")
+            self.level = 1
+            self.originate(1, self.members if ClusterHeadAlgorithm.elect_heads else self.nodes.keys())
+            if ClusterHeadAlgorithm.levels > 1:
+                self.register_task("update_hierarchy", self.update_hierarchy, interval=2 * ClusterHeadAlgorithm.update_window,
+                                   delay=ClusterHeadAlgorithm.hierarchy_timeout)
+            self.info("%s: Initial routing table: %s", self.printing_suffix, self.routing_table)
             
             for next_peer in peers:
-                #await self.send_packet(next_peer[1], ClusterHello(self.node_id))
                 self.ez_send(next_peer[1], ClusterHello(self.node_id))
-                # self.ez_send(next_peer[1], ClusterHello(self.node_id))
 
-        await asyncio.sleep(random.uniform(8.0, 14.0))
+        # routers that do not have a route yet hold on to the messages, see hold
+        await self.sleep(self.random.uniform(8.0, 14.0))
 
         for message in ClusterHeadAlgorithm.messages:
-            if self.node_id is message.sender:
-                await asyncio.sleep(random.uniform(0.5, 1.5))
+            if self.node_id == message.sender:
+                await self.sleep(self.random.uniform(0.5, 1.5))
+                self.record_broadcast((message.sender, message.data))
                 if self.is_cluster_head:
-                    if message.destination in [x[0] for x in self.nodes.items()]:
-                    # Destination is in the current cluster, so simply send it to them!
-                        id, peer = [x for x in self.nodes.items() if x[0] is message.destination][0]
-                        print(f"{self.printing_suffix}: Sending message to {id} destined for {message.destination}")
-                        #await self.send_packet(peer, message)
-                        self.ez_send(peer, message)
-                        continue
-                    
-                    shouldContinue = False
-                    for key_id, value in self.routing_table.items():
-                        if message.destination in value:
-                            key_peer = [x[1] for x in self.nodes.items() if x[0] is key_id][0]
-                            print(f"{self.printing_suffix}: Sending message to {key_id} destined for {message.destination}")
-                            #await self.send_packet(key_peer, message)
-                            self.ez_send(key_peer, message)
-                            shouldContinue = True
-                            break
-                    
-                    if shouldContinue: continue
-                    # Uh oh, not found in the routing table?
-                    print(f"\033[31m{self.printing_suffix}: Message for {message.destination} could not be send. Routing table: {self.routing_table}\033[31m")
-                    
+                    # Destinations in the current cluster are their own next hop, and we are our own
+                    self.receive_data(message)
+                elif self.connected_heads:
+                    self.info("%s: Forwarding message to %d destined for %d", self.printing_suffix, self.connected_heads[0][1], message.destination)
+                    self.send_data(self.connected_heads[0][1], message)
                 else:
-                    print(f"{self.printing_suffix}: Forwarding message to {self.connected_heads[0][1]} destined for {message.destination}")
-                    #await self.send_packet(self.connected_heads[0][0], message)
-                    self.ez_send(self.connected_heads[0][0], message)
+                    # No head said hello, so there is nobody to route it
+                    self.warning("%s: Message for %d could not be send, not connected to a cluster head.", self.printing_suffix, message.destination)
     
+    async def elect(self):
+        """
+        Weight based head election, like DMAC: every node sends its weight to its neighbours and
+        decides once all heavier neighbours did. It joins the heaviest neighbouring head that still
+        has room, or becomes a head itself. Takes O(degree) messages per node.
+
+        The weight is the degree, capped at the cluster size so hubs do not all win, ties go to the lowest id.
+        """
+        weight = min(len(self.nodes), ClusterHeadAlgorithm.max_cluster_size - 1)
+        self.weights[self.node_id] = weight
+        for peer in self.nodes.values():
+            self.ez_send(peer, HeadWeight(self.node_id, weight))
+        self.try_decide()
+
+        try:
+            await asyncio.wait_for(self.elected.wait(), ClusterHeadAlgorithm.election_timeout)
+        except asyncio.TimeoutError:
+            self.warning("__ %d: Election timed out waiting for %s, becoming a cluster head.", self.node_id, [x for x in self.nodes if x not in self.decisions])
+            self.decide(self.node_id)
+
+    def election_key(self, node_id):
+        return self.weights[node_id], -node_id
+
+    def try_decide(self):
+        if self.elected.is_set() or self.joining is not None or self.node_id not in self.weights:
+            return
+        if any(x not in self.weights for x in self.nodes):
+            return
+        heavier = [x for x in self.nodes if self.election_key(x) > self.election_key(self.node_id)]
+        if any(x not in self.decisions for x in heavier):
+            return
+
+        heads = [x for x in heavier if self.decisions[x] == x and x not in self.rejected]
+        if heads:
+            self.joining = max(heads, key=self.election_key)
+            self.ez_send(self.nodes[self.joining], JoinCluster(self.node_id))
+        else:
+            self.decide(self.node_id)
+
+    def decide(self, cluster_head):
+        self.cluster_head = cluster_head
+        self.joining = None
+        self.decisions[self.node_id] = cluster_head
+        for peer in self.nodes.values():
+            self.ez_send(peer, HeadDecision(self.node_id, cluster_head))
+        if cluster_head == self.node_id:
+            self.info("__ %d: Elected as cluster head", self.node_id)
+        else:
+            self.debug("__ %d: Joined the cluster of %d", self.node_id, cluster_head)
+        self.elected.set()
+
+    @message_wrapper(HeadWeight)
+    async def on_head_weight(self, peer: Peer, payload: HeadWeight) -> None:
+        self.weights[payload.node_id] = payload.weight
+        self.try_decide()
+
+    @message_wrapper(HeadDecision)
+    async def on_head_decision(self, peer: Peer, payload: HeadDecision) -> None:
+        self.decisions[payload.node_id] = payload.cluster_head
+        self.try_decide()
+
+    @message_wrapper(JoinCluster)
+    async def on_join_cluster(self, peer: Peer, payload: JoinCluster) -> None:
+        # Full clusters turn nodes away, they try the next head or become one
+        accepted = self.cluster_head == self.node_id and len(self.members) + 1 < ClusterHeadAlgorithm.max_cluster_size
+        if accepted:
+            self.members.add(payload.node_id)
+            self.metrics.gauge("members", len(self.members))
+            # Late joins change the advert we already sent out
+            if self.is_cluster_head and self.originate(1, self.members):
+                for _, gateway_id in self.connected_gateways:
+                    self.mark_dirty(gateway_id, [(1, self.node_id)])
+        self.ez_send(peer, JoinReply(self.node_id, accepted))
+
+    @message_wrapper(JoinReply)
+    async def on_join_reply(self, peer: Peer, payload: JoinReply) -> None:
+        if payload.cluster_head != self.joining:
+            return
+        if payload.accepted:
+            self.decide(payload.cluster_head)
+        else:
+            self.rejected.add(payload.cluster_head)
+            self.joining = None
+            self.try_decide()
+
     @message_wrapper(ClusterHello)
     async def on_hello(self, peer: Peer, payload: ClusterHello) -> None:
-        if (peer, payload.cluster_head) not in self.connected_heads:
-            self.connected_heads.append((peer, payload.cluster_head))
+        new_head = (peer, payload.cluster_head) not in self.connected_heads
+        if new_head:
+            # Messages are forwarded to the first head, which should be the one we joined
+            if payload.cluster_head == self.cluster_head:
+                self.connected_heads.insert(0, (peer, payload.cluster_head))
+            else:
+                self.connected_heads.append((peer, payload.cluster_head))
 
-        print(f"{self.printing_suffix}: Received cluster hello from {payload.cluster_head}")
-        
-        # self.routing_table[self.node_id] = set([x[0] for x in self.nodes.items()])
-        # self.routing_table[payload.cluster_head] 
+        self.debug("%s: Received cluster hello from %d", self.printing_suffix, payload.cluster_head)
 
         if len(self.connected_heads) > 1:
             self.is_gateway = True
             self.printing_suffix = f"GW {self.node_id}"
-            print(f"{self.printing_suffix}: I have become a GW. My connected heads: {[x[1] for x in self.connected_heads]}")
+            self.info("%s: I have become a GW. My connected heads: %s", self.printing_suffix, [x[1] for x in self.connected_heads])
 
-            # Send a message to all connected heads saying I have become a gateway for them
+            # Send a message to all connected heads saying I have become a gateway for them,
+            # as a head ourselves we connect our own cluster as well
+            heads = [x[1] for x in self.connected_heads] + ([self.node_id] if self.is_cluster_head else [])
             for cluster_head_peer, _ in self.connected_heads:
-                #await self.send_packet(cluster_head_peer, GatewayAck(self.node_id))
-                self.ez_send(cluster_head_peer, GatewayAck(self.node_id))
+                self.ez_send(cluster_head_peer, GatewayAck(self.node_id, encode_ids(heads)))
 
     @message_wrapper(GatewayAck)
     async def on_gateway_ack(self, peer: Peer, payload: GatewayAck) -> None:
         if not self.is_cluster_head: 
-            print(f"{self.printing_suffix}: I'm not a cluster head, but for some reason I got a GW ACK message from {payload.gateway_id}...")
+            self.warning("%s: I'm not a cluster head, but for some reason I got a GW ACK message from %d...", self.printing_suffix, payload.gateway_id)
             return
 
-        if (peer, payload.gateway_id) not in self.connected_gateways:
-            self.connected_gateways.append((peer, payload.gateway_id))
-            print(f"{self.printing_suffix}: Gateways: {[x[1] for x in self.connected_gateways]}")
-
-        # As a cluster head we want to send a message to all gateways informing them of all connected nodes
-        for gateway_peer, _ in self.connected_gateways:
-            # self.ez_send(gateway_peer, AdvertiseNeighbours(self.node_id, str([x[0] for x in self.nodes.items()])))
-            #await self.send_packet(gateway_peer, RoutingUpdate(self.node_id, str(self.routing_table)))
-            self.ez_send(gateway_peer, RoutingUpdate(self.node_id, str(self.routing_table)))
-            
-    @message_wrapper(AdvertiseNeighbours)
-    async def on_advertise_neighbours(self, peer: Peer, payload: AdvertiseNeighbours) -> None:
-        if not self.is_gateway:
-            print(f"{self.printing_suffix}: I'm not a GW, but somehow I got a AN message from {payload.sender}...")
+        try:
+            heads = set(decode_ids(payload.heads))
+        except ValueError:
+            self.warning("%s: Malformed GW ACK from %d, ignoring.", self.printing_suffix, payload.gateway_id)
+            return
+        self.gateway_heads[payload.gateway_id] = heads
+        self.gateway_peers[payload.gateway_id] = peer
+        self.select_gateways()
+
+    def select_gateways(self):
+        """
+        Keep gateways_per_pair gateways to every neighbouring head, preferring those that connect
+        the most heads (so one gateway covers several pairs) and then the lowest id. Both heads
+        of a pair hear of the same gateways, so they end up selecting the same ones.
+        """
+        others = {head for heads in self.gateway_heads.values() for head in heads if head != self.node_id}
+        selected = set()
+        for other in others:
+            candidates = sorted(
+                (x for x, heads in self.gateway_heads.items() if other in heads),
+                key=lambda x: (-len(self.gateway_heads[x]), x)
+            )
+            selected.update(candidates[:ClusterHeadAlgorithm.gateways_per_pair])
+
+        current = {x[1] for x in self.connected_gateways}
+        for gateway_id in sorted(current - selected):
+            self.ez_send(self.gateway_peers[gateway_id], GatewayRole(self.node_id, False))
+            self.dirty.pop(gateway_id, None)
+        for gateway_id in sorted(selected - current):
+            self.ez_send(self.gateway_peers[gateway_id], GatewayRole(self.node_id, True))
+        self.connected_gateways = [(self.gateway_peers[x], x) for x in sorted(selected)]
+        self.metrics.gauge("gateways", len(selected))
+        if selected != current:
+            self.info("%s: Gateways: %s", self.printing_suffix, sorted(selected))
+
+        # As a cluster head we want to inform the new gateways of all connected nodes,
+        # the gateways we already had know everything
+        for gateway_id in sorted(selected - current):
+            self.mark_dirty(gateway_id)
+
+    @message_wrapper(GatewayRole)
+    async def on_gateway_role(self, peer: Peer, payload: GatewayRole) -> None:
+        if not payload.selected:
+            self.selected_by.discard(payload.cluster_head)
+            self.dirty.pop(payload.cluster_head, None)
+            self.debug("%s: Demoted by %d, still selected by %s", self.printing_suffix, payload.cluster_head, sorted(self.selected_by))
             return
 
-        #print(f"{self.node_id}: Received AN message from: {payload.cluster_head}, with: {payload.neighbours}")
-
-        # Update routing table
-
-        if payload.cluster_head not in self.routing_table:
-            self.routing_table[payload.cluster_head] = set(eval(payload.neighbours))
-        else:
-
-            self.routing_table[payload.cluster_head].update(eval(payload.neighbours))
-
-        print(f"{self.printing_suffix}: AN message from {payload.cluster_head}. Updated routing table: {self.routing_table}")
-
-        # Send routing update to all connected heads, except for the one from which you received the AN message
-        for peer_head, id_head in self.connected_heads:
-            if peer_head is peer: 
-                continue
-
-            #await self.send_packete(peer_head, RoutingUpdate(self.node_id, str(self.routing_table)))
-            self.ez_send(peer_head, RoutingUpdate(self.node_id, str(self.routing_table)))
+        self.selected_by.add(payload.cluster_head)
+        # A newly selecting head has not seen any of the adverts we already passed on
+        if len(self.routing_table) > 0:
+            self.mark_dirty(payload.cluster_head)
 
     @message_wrapper(RoutingUpdate)
     async def on_routing_update(self, peer: Peer, payload: RoutingUpdate) -> None:
         if not self.is_cluster_head and not self.is_gateway:
             return
 
-        incoming_rt = eval(payload.routing_table)
-        
-        incoming_rt.pop(self.node_id, None)
-        # print(f"{self.printing_suffix}: RU from {payload.sender}, RT before update: {self.routing_table}")
-        
-        new_entry = set()
-        new_entry.add(payload.sender)
-        for key, values in incoming_rt.items():
-            new_entry.add(key)
-            # print(f"{self.printing_suffix}: RU from {payload.sender}, TEST {key}: {values}")
-            new_entry.update(values)
-        
-        if payload.sender in self.routing_table and self.routing_table[payload.sender] == new_entry:
-            # We already got the latest information!
-            print(f"{self.printing_suffix}: RU from {payload.sender}, but new entry is the same! So, ignoring.")
+        try:
+            incoming = decode_adverts(payload.adverts)
+        except ValueError:
+            self.warning("%s: Malformed RU from %d, ignoring.", self.printing_suffix, payload.sender)
             return
 
-        self.routing_table[payload.sender] = new_entry
-        # self.routing_table = {**self.routing_table, **incoming_rt}
-        print(f"{self.printing_suffix}: RU from {payload.sender}, adding to RT: {new_entry}, after update: {self.routing_table}")
+        # Only keep the adverts that are newer, or shorter, than what we know
+        sender = self.node_id_from_peer(peer)
+        changed = [
+            key for key, version, hops, parent, members, summary in incoming
+            if key[1] != self.node_id and self.routing_table.apply(sender, key, version, hops, parent, members, summary)
+        ]
+
+        if not changed:
+            # We already got the latest information!
+            self.debug("%s: RU from %d, but nothing is new! So, ignoring.", self.printing_suffix, payload.sender)
+            return
 
-        # For all gateways send another advertise neighbours message
-        #print(f"{self.printing_suffix}: Sending routing table: {str(self.routing_table)} to {[x[1] for x in self.connected_gateways]}")
-        # print(f"{self.printing_suffix}: RU from {payload.sender}, Known gateways: {self.connected_gateways}")
-        # for gateway_peer, _ in self.connected_gateways:
+        self.debug("%s: RU from %d, updated heads %s, after update: %s", self.printing_suffix, payload.sender, changed, self.routing_table)
 
+        # Pass the changes on, heads to their gateways and gateways to the heads that selected them
         if self.is_gateway:
-            for head_peer, _ in self.connected_heads:
-                if head_peer is peer: continue
+            # Only the heads that selected us as their gateway
+            for head_peer, head_id in self.connected_heads:
+                if head_id == sender or head_id not in self.selected_by: continue
 
-                #await self.send_packet(head_peer, RoutingUpdate(self.node_id, str(self.routing_table)))
-                self.ez_send(head_peer, RoutingUpdate(self.node_id, str(self.routing_table)))
+                self.mark_dirty(head_id, changed)
         
         if self.is_cluster_head:
-            for gateway_peer, _ in self.connected_gateways:
-                if gateway_peer is peer: continue
-                
-                #await self.send_packet(gateway_peer, RoutingUpdate(self.node_id, str(self.routing_table)))
-                self.ez_send(gateway_peer, RoutingUpdate(self.node_id, str(self.routing_table)))
-
-        # for _, next_peer in self.nodes.items():
-        #     if next_peer is peer: 
-        #         continue
+            for gateway_peer, gateway_id in self.connected_gateways:
+                if gateway_id == sender: continue
 
-        #     self.ez_send(peer, RoutingUpdate(self.node_id, str(self.routing_table)))
+                self.mark_dirty(gateway_id, changed)
     
+    def mark_dirty(self, neighbour_id, origins=None):
+        # Adverts are collected for update_window seconds, so a burst of changes
+        # goes out as a single routing update per neighbour
+        if neighbour_id in self.dirty:
+            self.ru_suppressed += 1
+            if self.dirty[neighbour_id] is not None:
+                if origins is None:
+                    self.dirty[neighbour_id] = None
+                else:
+                    self.dirty[neighbour_id].update(origins)
+        else:
+            self.dirty[neighbour_id] = None if origins is None else set(origins)
+            self.metrics.gauge("dirty", len(self.dirty))
+
+        if not self.is_pending_task_active("flush_routing_updates"):
+            self.register_task("flush_routing_updates", self.flush_routing_updates,
+                               delay=ClusterHeadAlgorithm.update_window)
+
+    def flush_routing_updates(self):
+        dirty, self.dirty = self.dirty, {}
+        for neighbour_id, origins in dirty.items():
+            if origins is None:
+                origins = self.routing_table.adverts.keys()
+            origins = [key for key in origins if self.in_scope(key)]
+            if not origins:
+                continue
+            self.ez_send(self.nodes[neighbour_id], RoutingUpdate(self.node_id, self.routing_table.encode(origins)))
+            self.ru_sent += 1
+        self.debug("%s: Sent RU to %s, %d sent and %d suppressed so far", self.printing_suffix, list(dirty), self.ru_sent, self.ru_suppressed)
+
+    def originate(self, level, members, parent=None, summary=None):
+        # Our advert of the given level, keeping the parent and summary we advertised before unless new ones are given
+        advert = self.routing_table.adverts.get((level, self.node_id))
+        if parent is None:
+            parent = self.node_id if advert is None else advert.parent
+        if summary is None:
+            summary = 0 if advert is None else advert.summary
+        return self.routing_table.originate(self.node_id, members, level, parent, summary)
+
+    def radius(self, level):
+        # hops between a head of this level and the heads of its clusters one level down
+        return ClusterHeadAlgorithm.cluster_radius * 2 ** (level - 2)
+
+    def in_scope(self, key):
+        # adverts go as far as the election of the level above needs, those of the top level go everywhere
+        level = key[0]
+        return level >= ClusterHeadAlgorithm.levels or self.routing_table.adverts[key].hops <= self.radius(level + 1)
+
+    def update_hierarchy(self):
+        """
+        The heads of a level within radius(level + 1) hops of each other form the clusters of the
+        level above: the heaviest of them (most members, then a hash of the id) becomes its head once it
+        has been the heaviest for hierarchy_timeout, the others join the nearest head of that level.
+        Heads that joined one no longer count as heavier, so those further away take the level in turn.
+        Heads of level 2 and up list the heads of their clusters one level down, and summarize all
+        nodes of those clusters in a Bloom filter: the union (|) of their summaries, or for level 2
+        of their members.
+
+        As adverts only go as far as in_scope allows, the routing table holds the nearby clusters
+        of every level and the top level ones of the whole network, instead of every node. Routers
+        far away route by the summaries, towards the heads that are closer to the destination.
+        """
+        adverts = self.routing_table.adverts
+        changed = []
+
+        def weight(key):
+            # ties go by a hash of the id, by the id itself the heads would wait on each other across the network
+            return adverts[key].size(), mix(key[1]), -key[1]
+
+        level = 2
+        while level <= ClusterHeadAlgorithm.levels and self.level >= level - 1:
+            radius = self.radius(level)
+            # withdrawn adverts of level 2 and up have no members, and heads that joined
+            # another head are out of the running
+            near = [
+                key for key, advert in adverts.items()
+                if key[0] == level - 1 and advert.hops <= radius and (level == 2 or advert.size())
+                and (key[1] == self.node_id or advert.parent == key[1])
+            ]
+            below = adverts[(level - 1, self.node_id)]
+            # hops are not the same both ways, so the head we joined may be too far to get our adverts:
+            # if it has not listed us by the time it can advertise again, we join another
+            joined = adverts.get((level, below.parent))
+            if (below.parent != self.node_id and joined is not None and self.node_id not in joined.members
+                    and self.now() - self.joined[level] >= 2 * ClusterHeadAlgorithm.hierarchy_timeout):
+                self.unheard.add((level, below.parent))
+            # a head only gives way to heavier heads, or two of them would keep taking turns
+            heading = self.level >= level
+            heads = sorted(
+                (advert.hops, key[1]) for key, advert in adverts.items()
+                if key[0] == level and key[1] != self.node_id and advert.hops <= radius and advert.size()
+                and key not in self.unheard
+                and not (heading and (level - 1, key[1]) in adverts
+                         and weight((level - 1, key[1])) < weight((level - 1, self.node_id)))
+            )
+            # every head that comes and goes is an advert to the whole network,
+            # so give the heavier heads nearby the time to make themselves known
+            waited = self.now() - self.electing.setdefault(level, self.now())
+            if max(near, key=weight)[1] == self.node_id and (heading or waited >= ClusterHeadAlgorithm.hierarchy_timeout):
+                parent = self.node_id
+            elif heads:
+                # stay with the head we joined while it is near, every move changes the adverts of two heads
+                parent = below.parent if any(x == below.parent for _, x in heads) else heads[0][1]
+            else:
+                # wait for the heavier heads nearby to take the level, or to join others
+                parent = None
+
+            if parent != below.parent:
+                self.joined[level] = self.now()
+            if self.originate(level - 1, below.members, self.node_id if parent is None else parent):
+                changed.append((level - 1, self.node_id))
+            if parent != self.node_id:
+                break
+
+            children = {self.node_id}
+            summary = 0
+            for key, advert in adverts.items():
+                if key[0] == level - 1 and advert.parent == self.node_id and (level == 2 or advert.size()):
+                    children.add(key[1])
+                    if level == 2:
+                        summary |= bloom((key[1], *advert.members), ClusterHeadAlgorithm.summary_bits,
+                                         ClusterHeadAlgorithm.summary_hashes)
+                    else:
+                        summary |= advert.summary
+            # the clusters joining us go out together, at most once per hierarchy_timeout
+            recent = heading and self.now() - self.advertised[level] < ClusterHeadAlgorithm.hierarchy_timeout
+            if not recent and self.originate(level, children, summary=summary):
+                self.advertised[level] = self.now()
+                changed.append((level, self.node_id))
+            level += 1
+
+        if self.level != level - 1:
+            self.info("%s: Cluster head of level %d", self.printing_suffix, level - 1)
+        # Withdraw the levels we are no longer a head of
+        for withdrawn in range(level, self.level + 1):
+            if self.originate(withdrawn, (), summary=0):
+                changed.append((withdrawn, self.node_id))
+        self.level = level - 1
+
+        if changed:
+            for _, gateway_id in self.connected_gateways:
+                self.mark_dirty(gateway_id, changed)
+
     @message_wrapper(DataMessage)
     async def on_data_message(self, _: Peer, payload: DataMessage) -> None:
-        if self.node_id is payload.destination:
+        self.receive_data(payload)
+
+    @message_wrapper(SummaryData)
+    async def on_summary_data(self, _: Peer, payload: SummaryData) -> None:
+        self.receive_summary_data(payload)
+
+    def receive_data(self, payload):
+        if self.node_id == payload.destination:
             # Yaay, we got a message
-            print(f"{self.printing_suffix}: Yaay, got a message from {payload.sender}. Data: {payload.data}")
+            self.info("%s: Yaay, got a message from %d. Data: %s", self.printing_suffix, payload.sender, payload.data)
+            self.record_delivery((payload.sender, payload.data))
             return
         
-        if self.is_cluster_head:
-            if payload.destination in [x[0] for x in self.nodes.items()]:
-                # Destination is in the current cluster, so simply send it to them!
-                id, destination_peer = [x for x in self.nodes.items() if x[0] is payload.destination][0]
-                print(f"{self.printing_suffix}: Sending message to {id} destined for {payload.destination}")
-                #await self.send_packet(destination_peer, payload)
-                self.ez_send(destination_peer, payload)
-                return
-
-        for key_id, value in self.routing_table.items():
-            if payload.destination in value or payload.destination is key_id:
-                key_peer = [x[1] for x in self.nodes.items() if x[0] is key_id][0]
-                print(f"{self.printing_suffix}: Forwarding message to {key_id} destined for {payload.destination}")
-                #await self.send_packet(key_peer, payload)
-                self.ez_send(key_peer, payload)
-                return
-
-        # Destination not found, send error back?
-        print(f"\033[31m{self.printing_suffix}: Trying to send message, but could not find destination {payload.destination}.\033[31m")
-
-    async def send_packet(self, destination: Peer, payload):
-        #await asyncio.sleep(random.uniform(0.5, 1.5))
-        self.ez_send(destination, payload)
\ No newline at end of file
+        if not self.forward(payload):
+            self.hold(payload)
+
+    def receive_summary_data(self, payload):
+        if self.node_id == payload.destination:
+            self.receive_data(payload)
+            return
+
+        try:
+            tried = decode_ids(payload.tried)
+        except ValueError:
+            self.warning("%s: Malformed summary data from %d, ignoring.", self.printing_suffix, payload.sender)
+            return
+        head = payload.head
+        if head == self.node_id and self.routing_table.next_hop(payload.destination) is None:
+            # Our summary has the destination, so should the summary of one of our clusters one level down
+            if self.routing_table.summary_route(payload.destination, tried, self.level) is None:
+                # None of them has, our clusters do not have it
+                self.false_positives += 1
+                self.debug("%s: Summary false positive for %d, tried %s", self.printing_suffix, payload.destination, tried)
+                tried.append(self.node_id)
+            head = None
+        if not self.forward(payload, tried, head):
+            self.hold(payload, tried, head)
+
+    def hold(self, payload, tried=(), head=None):
+        # Keep a message without a route for route_timeout seconds, the routes may still be on their way
+        self.held.append((self.now() + ClusterHeadAlgorithm.route_timeout, payload, list(tried), head))
+        self.metrics.gauge("held", len(self.held))
+        if len(self.held) == 1:
+            self.register_anonymous_task("retry_held", self.retry_held, delay=ClusterHeadAlgorithm.update_window)
+
+    def retry_held(self):
+        held, self.held = self.held, []
+        now = self.now()
+        for deadline, payload, tried, head in held:
+            if self.forward(payload, tried, head):
+                continue
+            if now < deadline:
+                self.held.append((deadline, payload, tried, head))
+            else:
+                self.warning("%s: Trying to send message, but could not find destination %d.", self.printing_suffix, payload.destination)
+        if self.held:
+            self.register_anonymous_task("retry_held", self.retry_held, delay=ClusterHeadAlgorithm.update_window)
+
+    def forward(self, payload, tried=(), head=None):
+        """
+        Send a message for payload.destination on to the next hop, returns False if there is no route.
+
+        Shortest known route first, destinations in the current cluster are their own next hop.
+        Without one the message goes towards the head of a summary that has the destination, or
+        on towards head when it was already going there. If the destination is not in the
+        cluster of that head (a false positive of the summary), the head tries the next summary.
+        """
+        route = self.routing_table.next_hop(payload.destination)
+        if route is not None:
+            next_hop, hops = route
+            self.debug("%s: Forwarding message to %d destined for %d (%d hops)", self.printing_suffix, next_hop, payload.destination, hops)
+            self.send_data(next_hop, DataMessage(payload.sender, payload.destination, payload.data))
+            return True
+
+        route = self.routing_table.next_hop(head) if head is not None else None
+        if route is not None:
+            next_hop, hops = route
+        else:
+            found = self.routing_table.summary_route(payload.destination, tried)
+            if found is None:
+                return False
+            head, next_hop, hops = found
+        self.debug("%s: Forwarding message to %d destined for %d through head %d (%d hops)", self.printing_suffix, next_hop, payload.destination, head, hops)
+        self.send_data(next_hop, SummaryData(head, encode_ids(tried), payload.sender, payload.destination, payload.data))
+        return True
+
+    def send_data(self, node_id, payload):
+        """
+        Send a DataMessage or SummaryData to a neighbour. With reliable_window set it goes as a
+        HopData frame with a sequence number, and is sent again until the neighbour acks it
+        (see reliable.ReliableLink), otherwise it is sent once.
+        """
+        if not ClusterHeadAlgorithm.reliable_window:
+            self.ez_send(self.nodes[node_id], payload)
+            return
+        link = self.link(node_id)
+        self.send_frames(node_id, link, link.send(payload, self.now()))
+        self.schedule_retransmit()
+
+    def link(self, node_id):
+        link = self.links.get(node_id)
+        if link is None:
+            link = self.links[node_id] = ReliableLink(ClusterHeadAlgorithm.reliable_window, ClusterHeadAlgorithm.max_retransmits)
+        return link
+
+    def send_frames(self, node_id, link, frames):
+        for seq, payload in frames:
+            head, tried = (payload.head, payload.tried) if isinstance(payload, SummaryData) else (-1, b"")
+            self.ez_send(self.nodes[node_id], HopData(seq, link.base, head, tried, payload.sender, payload.destination, payload.data))
+        self.metrics.gauge("unacked", len(link.unacked))
+        self.metrics.gauge("send_queue", len(link.queue))
+
+    def schedule_retransmit(self):
+        # One task for all links, due when the oldest unacknowledged message of any of them is
+        deadline = min((x for x in (link.deadline() for link in self.links.values()) if x is not None), default=None)
+        if deadline is None or (self.retransmit_at is not None and self.retransmit_at <= deadline):
+            return
+        self.retransmit_at = deadline
+        self.cancel_pending_task("retransmit")
+        self.register_task("retransmit", self.retransmit, delay=max(deadline - self.now(), 0))
+
+    def retransmit(self):
+        self.retransmit_at = None
+        now = self.now()
+        for node_id, link in self.links.items():
+            frames, failed = link.expire(now)
+            for payload in failed:
+                self.warning("%s: Gave up sending message for %d to %d after %d retransmissions.", self.printing_suffix,
+                             payload.destination, node_id, link.max_retransmits)
+            if frames:
+                self.debug("%s: Sending %d messages to %d again, timeout now %.3fs", self.printing_suffix, len(frames), node_id, link.rto)
+            self.send_frames(node_id, link, frames)
+        self.schedule_retransmit()
+
+    @message_wrapper(HopData)
+    async def on_hop_data(self, peer: Peer, payload: HopData) -> None:
+        node_id = self.node_id_from_peer(peer)
+        if node_id is None:
+            return
+        link = self.link(node_id)
+        new = link.receive(payload.seq, payload.base)
+        # Duplicates are acked as well, the ack before may have been lost
+        self.ez_send(peer, HopAck(link.expected, payload.seq))
+        if not new:
+            return
+        if payload.head < 0:
+            self.receive_data(DataMessage(payload.sender, payload.destination, payload.data))
+        else:
+            self.receive_summary_data(SummaryData(payload.head, payload.tried, payload.sender, payload.destination, payload.data))
+
+    @message_wrapper(HopAck)
+    async def on_hop_ack(self, peer: Peer, payload: HopAck) -> None:
+        node_id = self.node_id_from_peer(peer)
+        link = self.links.get(node_id)
+        if link is None:
+            return
+        self.send_frames(node_id, link, link.ack(payload.cumulative, payload.seq, self.now()))
+        self.schedule_retransmit()
@@ -1,75 +1,258 @@
 from __future__ import annotations
 
+import dataclasses
 import random
+import struct
 import typing
-from asyncio import Event
+from asyncio import Event, Future, get_running_loop, iscoroutine, sleep, wait
+from time import perf_counter
 from typing import Dict, List, Tuple, Callable
 from ipv8.community import Community, CommunitySettings
-from ipv8.lazy_community import lazy_wrapper
+from ipv8.lazy_community import lazy_wrapper, lazy_wrapper_unsigned
+from ipv8.messaging.payload_dataclass import overwrite_dataclass
 from ipv8.messaging.serialization import Payload
-from ipv8.types import Peer, LazyWrappedHandler, MessageHandlerFunction
+from ipv8.types import Address, Peer, LazyWrappedHandler, MessageHandlerFunction
+
+from metrics import Metrics
 
 DataclassPayload = typing.TypeVar('DataclassPayload')
 AnyPayload = typing.Union[Payload, DataclassPayload]
 
+# log levels of DistributedAlgorithm.log_level
+LOG_SILENT = -1
+LOG_QUIET = 0   # warnings only
+LOG_INFO = 1    # outcomes, like deliveries
+LOG_DEBUG = 2   # every packet
+
+
+_payload_dataclass = overwrite_dataclass(dataclasses.dataclass)
+
+
+@_payload_dataclass(
+    msg_id=200
+)
+class Batch:
+    packets: bytes    # complete packets, each prefixed with its length, see pack_batch
+
+
+def pack_batch(packets: List[bytes]) -> bytes:
+    return b"".join(struct.pack(">H", len(packet)) + packet for packet in packets)
+
+
+def unpack_batch(data: bytes) -> List[bytes]:
+    packets = []
+    offset = 0
+    while offset < len(data):
+        if offset + 2 > len(data):
+            raise ValueError("Truncated batch")
+        length, = struct.unpack_from(">H", data, offset)
+        offset += 2
+        if offset + length > len(data):
+            raise ValueError("Truncated batch")
+        packets.append(data[offset:offset + length])
+        offset += length
+    return packets
+
 
 def message_wrapper(*payloads: type[AnyPayload]) -> Callable[[LazyWrappedHandler], MessageHandlerFunction]:
     return lazy_wrapper(*payloads)
 
 
+class NodeTable(Dict[int, Peer]):
+    """
+    Node id -> peer mapping that keeps a reverse index on the peer's mid,
+    so finding the node id of a peer is a dict lookup instead of a scan.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__()
+        self.ids: Dict[bytes, int] = {}
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, node_id: int, peer: Peer) -> None:
+        if node_id in self:
+            self.ids.pop(self[node_id].mid, None)
+        super().__setitem__(node_id, peer)
+        self.ids[peer.mid] = node_id
+
+    def __delitem__(self, node_id: int) -> None:
+        self.ids.pop(self[node_id].mid, None)
+        super().__delitem__(node_id)
+
+    def pop(self, node_id: int, *default):
+        if node_id not in self:
+            return super().pop(node_id, *default)
+        peer = self[node_id]
+        del self[node_id]
+        return peer
+
+    def popitem(self) -> Tuple[int, Peer]:
+        node_id, peer = super().popitem()
+        self.ids.pop(peer.mid, None)
+        return node_id, peer
+
+    def setdefault(self, node_id: int, peer: Peer) -> Peer:
+        if node_id not in self:
+            self[node_id] = peer
+        return self[node_id]
+
+    def update(self, *args, **kwargs) -> None:
+        for node_id, peer in dict(*args, **kwargs).items():
+            self[node_id] = peer
+
+    def clear(self) -> None:
+        super().clear()
+        self.ids.clear()
+
+    def node_id(self, peer: Peer) -> typing.Optional[int]:
+        return self.ids.get(peer.mid)
+
+
 class DistributedAlgorithm(Community):
     # @Todo: Make sure this is configurable
     community_id = b"\x05" * 20
 
+    # seconds to wait for all connections to come up, None waits for as long as it takes
+    start_timeout: typing.Optional[float] = None
+    # start with the nodes that could be reached after start_timeout, instead of stopping
+    allow_partial_start = False
+    # seconds between walks to the nodes that did not answer yet
+    walk_interval = 1.0
+    # random delay between being connected and starting the algorithm, in seconds
+    start_delay = (1.0, 3.0)
+    # seed for the random delays of the algorithms, None for different delays every run
+    seed: typing.Optional[int] = None
+    # what info() and debug() print, below LOG_DEBUG the per packet output costs nothing
+    log_level = LOG_DEBUG
+    # amount of events kept in the trace of every node, 0 to not trace
+    trace_size = 0
+    # send the packets for the same peer from one event loop tick as a single datagram
+    coalesce_sends = False
+    # bytes in a datagram of coalesced packets, kept below the usual MTU
+    max_batch_size = 1400
+
     def __init__(self, settings: CommunitySettings) -> None:
+        # before Community.__init__, which already registers message handlers
+        self.metrics = Metrics(self.trace_size)
         super().__init__(settings)
         self.event: Event = None  # type:ignore
         # Register the message handler for messages (with the identifier "1").
-        self.nodes: Dict[int, Peer] = {}
+        self.nodes: NodeTable = NodeTable()
+        self.expected: Dict[int | Address, int] = {}
+        self.node_futures: Dict[int, Future] = {}
+        # all randomness of an algorithm comes from here, so a seeded run can be repeated
+        self.random = random.Random()
+
+        # address -> (size, packets) waiting for the end of the tick, see coalesce_sends
+        self.send_queue: Dict[Address, Tuple[int, List[bytes]]] = {}
+        self.add_message_handler(Batch, self.on_batch)
 
     def node_id_from_peer(self, peer: Peer):
-        return next((key for key, p in self.nodes.items() if p == peer), None)
+        return self.nodes.node_id(peer)
 
     async def started(
-            self, node_id: int, connections: List[Tuple[int, int]], event: Event, use_localhost: bool = True
+            self, node_id: int, connections: List[Tuple[int, int | Address]], event: Event, use_localhost: bool = True
     ) -> None:
+        # connections are (node id, port) pairs, or (node id, address) when the address is known upfront
         self.event = event
         self.node_id = node_id
         self.connections = connections
-        self.on_start_delay = random.uniform(1.0, 3.0)  # Seconds
+        if self.seed is not None:
+            # one stream per node, independent of the order in which the nodes are started
+            self.random.seed(f"{self.seed}:{node_id}")
+        self.on_start_delay = self.random.uniform(*self.start_delay)  # Seconds
         host_network = self._get_lan_address()[0]
         host_network_base = ".".join(host_network.split(".")[:3])
 
-        async def _ensure_nodes_connected() -> None:
-            # Make connections to known peers
+        # One future per expected peer, resolved as soon as its introduction comes in
+        loop = get_running_loop()
+        self.expected = {conn: node_id for node_id, conn in connections}
+        self.node_futures = {node_id: loop.create_future() for node_id, _ in connections}
+
+        def _walk_to_missing_nodes() -> None:
+            # Make connections to known peers (again, for the ones whose packets got lost)
             for node_id, conn in connections:
+                if self.node_futures[node_id].done():
+                    continue
+                if isinstance(conn, tuple):
+                    self.walk_to(conn)
+                    continue
                 ip_address = f"{host_network_base}.{node_id + 10}"
                 if use_localhost:
                     ip_address = host_network
                 ad = (ip_address, conn)
                 self.walk_to(ad)
-            valid = False
-            conn_nodes = []
-
-            for node_id, node_port in self.connections:
-                conn_nodes = [
-                    p for p in self.get_peers() if p.address[1] == node_port
-                ]
-                if len(conn_nodes) == 0:
+
+        async def _wait_for_nodes() -> None:
+            futures = list(self.node_futures.values())
+            if futures:
+                _, pending = await wait(futures, timeout=self.start_timeout)
+            else:
+                pending = set()
+            self.cancel_pending_task("walk_to_nodes")
+
+            if pending:
+                missing = [node_id for node_id, future in self.node_futures.items() if not future.done()]
+                if not self.allow_partial_start:
+                    self.warning("[Node %d] Could not reach nodes %s, giving up", self.node_id, missing)
+                    self.stop()
                     return
-                valid = True
-                self.nodes[node_id] = conn_nodes[0]
-            if not valid:
-                return
-            self.cancel_pending_task("ensure_nodes_connected")
+                self.warning("[Node %d] Could not reach nodes %s, starting without them", self.node_id, missing)
+
             print(f'[Node {self.node_id}] Starting')
             self.register_anonymous_task(
                 "delayed_start", self.on_start, delay=self.on_start_delay
             )
 
-        self.register_task(
-            "ensure_nodes_connected", _ensure_nodes_connected, interval=.5, delay=1
-        )
+        self.register_task("walk_to_nodes", _walk_to_missing_nodes, interval=self.walk_interval, delay=0)
+        self.register_task("wait_for_nodes", _wait_for_nodes)
+
+    def _node_connected(self, peer: Peer) -> None:
+        node_id = self.expected.get(peer.address, self.expected.get(peer.address[1]))
+        if node_id is None or self.node_futures[node_id].done():
+            return
+        self.nodes[node_id] = peer
+        self.node_futures[node_id].set_result(peer)
+
+    def introduction_request_callback(self, peer: Peer, dist, payload) -> None:
+        self._node_connected(peer)
+
+    def introduction_response_callback(self, peer: Peer, dist, payload) -> None:
+        self._node_connected(peer)
+
+    def now(self) -> float:
+        # time of the event loop, virtual time when running in the simulator
+        return get_running_loop().time()
+
+    async def sleep(self, delay: float) -> None:
+        # delays go through the event loop clock, so the simulator can skip them
+        await sleep(delay)
+
+    def record_broadcast(self, key: typing.Hashable) -> None:
+        # time at which this node started sending the message identified by key
+        if key not in self.metrics.broadcasts:
+            now = self.metrics.broadcasts[key] = self.now()
+            self.metrics.event(now, "broadcast", key)
+
+    def record_delivery(self, key: typing.Hashable) -> None:
+        # time at which this node first delivered the message identified by key
+        if key not in self.metrics.deliveries:
+            now = self.metrics.deliveries[key] = self.now()
+            self.metrics.event(now, "deliver", key)
+
+    def info(self, message: str, *args) -> None:
+        # formatting is left to the moment it is printed, the arguments are not even turned into strings otherwise
+        if self.log_level >= LOG_INFO:
+            print(message % args if args else message)
+
+    def debug(self, message: str, *args) -> None:
+        if self.log_level >= LOG_DEBUG:
+            print(message % args if args else message)
+
+    def warning(self, message: str, *args) -> None:
+        # things that went wrong, in red
+        if self.log_level >= LOG_QUIET:
+            print(f"\033[31m{message % args if args else message}\033[0m")
 
     def on_start(self):
         pass
@@ -83,7 +266,84 @@ class DistributedAlgorithm(Community):
         self.register_anonymous_task('delayed_stop', delayed_stop, delay=delay)
 
     def ez_send(self, peer: Peer, *payloads: AnyPayload, **kwargs) -> None:
-        super().ez_send(peer, *payloads, **kwargs)
+        # same as Community.ez_send, but counts what is sent
+        packet = self.ezr_pack(payloads[-1].msg_id, *payloads, **kwargs)
+        name = type(payloads[-1]).__name__
+        node_id = self.nodes.node_id(peer)
+        self.metrics.sent[name] += 1
+        self.metrics.bytes_sent[name] += len(packet)
+        self.metrics.bytes_to[node_id] += len(packet)
+        if self.metrics.trace is not None:
+            self.metrics.event(self.now(), "send", name, node_id, len(packet))
+
+        if self.coalesce_sends:
+            self.queue_packet(peer.address, packet)
+        else:
+            self.send_datagram(peer.address, packet)
+
+    def send_datagram(self, address: Address, packet: bytes) -> None:
+        self.metrics.datagrams += 1
+        self.endpoint.send(address, packet)
+
+    def queue_packet(self, address: Address, packet: bytes) -> None:
+        if not self.send_queue:
+            get_running_loop().call_soon(self.flush_sends)
+
+        size, packets = self.send_queue.get(address, (0, []))
+        if packets and size + 2 + len(packet) > self.max_batch_size:
+            # full, the rest of the tick goes into the next datagram
+            self.send_batch(address, packets)
+            size, packets = 0, []
+        packets.append(packet)
+        self.send_queue[address] = (size + 2 + len(packet), packets)
+        self.metrics.gauge("send_queue", len(packets))
+
+    def flush_sends(self) -> None:
+        queue, self.send_queue = self.send_queue, {}
+        for address, (_, packets) in queue.items():
+            self.send_batch(address, packets)
+
+    def send_batch(self, address: Address, packets: List[bytes]) -> None:
+        if len(packets) == 1:
+            self.send_datagram(address, packets[0])
+            return
+        # the packets are signed themselves, the batch around them does not have to be
+        self.send_datagram(address, self.ezr_pack(Batch.msg_id, Batch(pack_batch(packets)), sig=False))
+
+    @lazy_wrapper_unsigned(Batch)
+    def on_batch(self, source_address: Address, payload: Batch) -> None:
+        try:
+            packets = unpack_batch(payload.packets)
+        except ValueError:
+            self.warning("[Node %d] Malformed batch from %s, ignoring.", self.node_id, source_address)
+            return
+        # every packet goes through the normal checks and handlers, as if it came in on its own
+        for packet in packets:
+            self.on_packet((source_address, packet))
 
     def add_message_handler(self, msg_num: int | type[AnyPayload], callback: MessageHandlerFunction) -> None:
-        super().add_message_handler(msg_num, callback)
+        # count every packet and time its handler, including the part that runs as a task
+        name = msg_num.__name__ if isinstance(msg_num, type) else f"message {msg_num}"
+        metrics = self.metrics
+
+        async def timed(coroutine, elapsed):
+            # the coroutine runs as a task later on, time spent waiting for its turn is not counted
+            start = perf_counter()
+            try:
+                return await coroutine
+            finally:
+                metrics.latency(name, elapsed + perf_counter() - start)
+
+        def handler(source_address: Address, data: bytes):
+            metrics.received[name] += 1
+            if metrics.trace is not None:
+                metrics.event(self.now(), "receive", name, len(data))
+            start = perf_counter()
+            result = callback(source_address, data)
+            elapsed = perf_counter() - start
+            if iscoroutine(result):
+                return timed(result, elapsed)
+            metrics.latency(name, elapsed)
+            return result
+
+        super().add_message_handler(msg_num, handler)
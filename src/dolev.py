@@ -1,7 +1,4 @@
 import string
-import json
-import random
-import asyncio
 
 from ipv8.community import CommunitySettings
 from ipv8.messaging.payload_dataclass import overwrite_dataclass
@@ -10,6 +7,7 @@ from dataclasses import dataclass
 from ipv8.types import Peer
 
 from da_types import *
+from paths import DisjointPaths, PathNodes, decode_path, encode_path, node_mask
 
 # We are using a custom dataclass implementation
 dataclass = overwrite_dataclass(dataclass)
@@ -19,9 +17,46 @@ dataclass = overwrite_dataclass(dataclass)
 )
 class Broadcast:
     origin: int
-    path: str    # only hashable types allowed so dictionary converted to string
+    seq: int    # per origin sequence number, (origin, seq) identifies the broadcast
+    path: bytes    # bitmask over node ids, see paths.encode_path
     message: str
 
+
+class BroadcastState:
+    """
+    Everything a node keeps about one broadcast, created when it is first seen.
+    """
+    __slots__ = ("paths", "delivered", "delivered_neighbours", "empty_path", "evicting")
+
+    def __init__(self) -> None:
+        self.paths = {}    # message -> DisjointPaths, a byzantine relay may alter the message
+        self.delivered = False
+        self.delivered_neighbours = set()
+        self.empty_path = False
+        self.evicting = False
+
+
+class SeqWindow:
+    """
+    Compact record of the sequence numbers of an origin that are finished:
+    everything up to floor, plus the few above it that finished out of order.
+    """
+    __slots__ = ("floor", "above")
+
+    def __init__(self) -> None:
+        self.floor = 0
+        self.above = set()
+
+    def __contains__(self, seq: int) -> bool:
+        return seq <= self.floor or seq in self.above
+
+    def add(self, seq: int) -> None:
+        self.above.add(seq)
+        while self.floor + 1 in self.above:
+            self.floor += 1
+            self.above.remove(self.floor)
+
+
 class Dolev(DistributedAlgorithm):
 
     # messages to start brodcast with
@@ -30,6 +65,12 @@ class Dolev(DistributedAlgorithm):
     # max bizantine nodes allowed
     f = 1
 
+    # upper bound on the amount of paths stored per message
+    max_paths = 64
+
+    # seconds to keep the state of a delivered broadcast around for late packets
+    state_timeout = 30
+
     # delay of the network (requirenment of assignment)
     delay_lower_bound = 1
     delay_upper_bound = 3
@@ -37,21 +78,11 @@ class Dolev(DistributedAlgorithm):
     def __init__(self, settings: CommunitySettings) -> None:
         super().__init__(settings)
 
-        self.empty_path_sent = {}
-        self.delivered_self = {}
-        self.delivered_neighbours = {}
-        self.paths = {}
-        self.empty_path = {}
-
-        # initailize internal data structures
-        # disjoint for all messages
-        for nodes in Dolev.messages:
-            message = Dolev.messages[nodes]
-            self.empty_path_sent[message] = False
-            self.delivered_self[message] = False
-            self.delivered_neighbours[message] = set()
-            self.paths[message] = []
-            self.empty_path[message] = False
+        self.seq = 0
+        # (origin, seq) -> BroadcastState, only for broadcasts that are in progress
+        self.broadcasts = {}
+        # origin -> SeqWindow of broadcasts that were delivered and evicted
+        self.finished = {}
 
         # add message handler for when a message is received
         self.add_message_handler(Broadcast, self.received)
@@ -60,126 +91,142 @@ class Dolev(DistributedAlgorithm):
         # check if this node has a message to brodcast
         if self.node_id in Dolev.messages.keys():
             # fetch message to brodcast
-            message = Dolev.messages[self.node_id]
+            self.record_broadcast((self.node_id, Dolev.messages[self.node_id]))
+            self.broadcast(Dolev.messages[self.node_id])
+
+    def broadcast(self, message):
+        self.seq += 1
+        state = self.broadcasts[(self.node_id, self.seq)] = BroadcastState()
+
+        # send brodcast message to all neighbours
+        for peer in list(self.nodes.values()):
+            self.send_with_delay(peer, self.node_id, self.seq, 0, message)
+
+        # deliver brodcast message to self
+        self.info("Message \"%s\" has been delivered, this is the source.", message)
+        self.mark_delivered(state, self.node_id, self.seq, message)
 
-            # send brodcast message to all neighbours
-            for peer in list(self.nodes.values()):
-                await self.send_with_delay(peer, [], message)
+    def mark_delivered(self, state, origin, seq, message):
+        state.delivered = True
+        self.deliver(origin, message)
 
-            # deliver brodcast message to self
-            self.delivered_self[message] = True
-            print(f"Message \"{message}\" has been delivered, this is the source.")
+        # keep the state a while longer, so late packets are not mistaken for a new broadcast
+        if not state.evicting:
+            state.evicting = True
+            self.register_anonymous_task("evict_broadcast", self.evict, origin, seq, delay=Dolev.state_timeout)
 
-    async def send_with_delay(self, destination, path, message):
+    def evict(self, origin, seq):
+        self.broadcasts.pop((origin, seq), None)
+        self.finished.setdefault(origin, SeqWindow()).add(seq)
+
+    def deliver(self, origin, message):
+        # called once for every message delivered, override to build on top of Dolev
+        self.record_delivery((origin, message))
+
+    def should_relay(self, neighbour_id, origin, message):
+        # override to skip neighbours that do not need this message anymore
+        return True
+
+    def send_with_delay(self, destination, origin, seq, path, message):
         # simulate network delay (requirenment of the assignment)
-        await asyncio.sleep(random.uniform(Dolev.delay_lower_bound, Dolev.delay_upper_bound))
-        self.ez_send(destination, Broadcast(self.node_id, json.dumps(list(path)), message))
-
-    # check for node disjoint paths
-    def ammount_disjoint_paths(self, origin, message):
-        disjoint_paths = 0
-        # this list is used to record nodes that have a path running over them
-        # has to include a dummy value -1, otherwise .update() doesn't work
-        traversed_nodes = {-1}
-        disjoint = True
-
-        if len(self.paths[message]) < 1:
-            return 0
-
-        # check for shortest paths first
-        paths_sorted = sorted(self.paths[message], key=len)
-
-        # iterate over all known paths from the origin of the message
-        for path in paths_sorted:
-            for node in path:
-                # if a node has already been used in a diffrent path,
-                # this path is not disjoint
-                # sinde path also includes destination and origin, ignore them
-                if node in traversed_nodes and node != self.node_id and node != origin:
-                    disjoint = False
-                    break
-            # if the path is disjoint, increment counter
-            # and update the list of nodes already used
-            if disjoint:
-                traversed_nodes.update(path)
-                disjoint_paths += 1
-            disjoint = True
-        return disjoint_paths
+        # every send is scheduled as its own task with its own delay,
+        # so fanning out to all neighbours does not block the caller
+        delay = self.random.uniform(Dolev.delay_lower_bound, Dolev.delay_upper_bound)
+        self.register_anonymous_task("send_with_delay", self.ez_send, destination,
+                                     Broadcast(origin, seq, encode_path(path), message), delay=delay)
 
     @lazy_wrapper(Broadcast)
     async def received(self, peer: Peer, payload: Broadcast) -> None:
 
         # recover data from the message to a usable format
         origin = payload.origin
+        seq = payload.seq
         message = payload.message
-        path = set(json.loads(payload.path))
+        path = decode_path(payload.path)
+        sender = self.node_id_from_peer(peer)
+        if sender is None:
+            # paths are made of node ids, a packet from outside the topology has no place in them
+            self.warning("Dropping a packet of %d from unknown peer %s.", origin, peer)
+            return
+
+        # broadcast is already delivered and forgotten
+        if origin in self.finished and seq in self.finished[origin]:
+            return
 
-        print(f"Received a packet from {origin}, by way of {path}.")
+        # if this is a new brodcast message
+        # initialize the state for this broadcast
+        state = self.broadcasts.get((origin, seq))
+        if state is None:
+            state = self.broadcasts[(origin, seq)] = BroadcastState()
+            self.metrics.gauge("broadcasts", len(self.broadcasts))
+
+        self.debug("Received a packet from %d, by way of %s.", origin, PathNodes(path))
+
+        # MD.1: Deliver if received directly from the source
+        if origin == sender and not state.delivered:
+            self.info("Message \"%s\" has been delivered directly from source %d.", message, origin)
+            self.mark_delivered(state, origin, seq, message)
 
         # MD.3 if empty path received, assume node has delivered the message
         if not path:
-            print (f"Neighbour {self.node_id_from_peer(peer)} delivered the message.")
-            self.delivered_neighbours[message].add(self.node_id_from_peer(peer))
+            self.debug("Neighbour %d delivered the message.", sender)
+            state.delivered_neighbours.add(sender)
 
-        # add id of this node to path of the message
-        path.add(self.node_id)
+        # add id of this node and of the sender to path of the message
+        # (an empty path from a neighbour that delivered stands for the path over that neighbour)
+        path |= node_mask(self.node_id) | node_mask(sender)
 
-        # if this is a new brodcast message
         # initialize the path registry entry for this message
-        if message not in self.paths.keys():
-            self.paths[message] = []
+        if message not in state.paths:
+            state.paths[message] = DisjointPaths(origin, self.node_id, self.f + 1, Dolev.max_paths)
+        paths = state.paths[message]
         # add path traveled by the message to the path registry
-        (self.paths[message]).append(path)
+        # a path dominated by a known one can not add a disjoint path, so it is not relayed
+        if not state.delivered and not paths.add(path):
+            self.debug("Path %s is a superset of a known path, dropping it.", PathNodes(path))
+            return
+        ammount_disjoint_paths = len(paths)
 
-        path_to_send = set() # path to be sent in the outgoing brodcast
+        path_to_send = 0 # path to be sent in the outgoing brodcast
         propagated_to = [] # record of where the brodcast was sent (for human-readible format)
 
+        # MD.2 & MD.5: Discard paths after delivery, relay only with an empty path
+        if state.delivered:
+            state.paths = {}
+        else:
+            path_to_send = path
+
         # propagate message further
-        for peer in list(self.nodes.values()):
+        for neighbour_id, neighbour in list(self.nodes.items()):
 
             # WIP MD.5
-            if self.empty_path[message]: continue;
-
-            # MD.1: Deliver if received directly from the source
-            if origin == self.node_id_from_peer(peer) and not self.delivered_self[message]:
-                self.delivered_self[message] = True
-                print(f"Message \"{message}\" has been delivered directly from source {origin}.")
-
-            # MD.2 & MD.5: Discard paths after delivery, relay only with an empty path
-            if self.delivered_self[message]:
-                self.paths[message] = []
-            else:
-                path_to_send = path
+            if state.empty_path: break
 
             # MD.3: Only relay to neighbors who have not delivered the message
             # MD.4: If empty path received, stop relying to that node
-            if self.node_id_from_peer(peer) in self.delivered_neighbours[message]: continue
+            if neighbour_id in state.delivered_neighbours: continue
 
             # do not send messages backwards (back to the sender)
-            if self.node_id_from_peer(peer) in path: continue
+            if path & node_mask(neighbour_id): continue
+
+            if not self.should_relay(neighbour_id, origin, message): continue
 
             # send the message
-            await self.send_with_delay(peer, path_to_send, message)
+            self.send_with_delay(neighbour, origin, seq, path_to_send, message)
 
             # record where the message was sent
-            propagated_to.append(self.node_id_from_peer(peer))
-
-            # WIP MD.5
-            if self.delivered_self[message] and not path_to_send:
-                self.empty_path[message] = True
+            propagated_to.append(neighbour_id)
 
-        # MD.5: if message delivered and empty path sent
-        #if self.delivered[message] and not path_to_send:
-        #    pass
-            #self.stop()
+        # WIP MD.5: the empty path has now been sent to every neighbour that needs it
+        if state.delivered and not path_to_send:
+            state.empty_path = True
 
         # check for disjoint vertice paths
-        #if self.is_disjoint_path(payload.origin):
-        ammount_disjoint_paths = self.ammount_disjoint_paths(origin, message)
-        if ammount_disjoint_paths >= Dolev.f + 1:
-            if not self.delivered_self[message]:
-                self.delivered[message] = True
-                print(f"Message \"{message}\" has been delivered from node {origin} via {ammount_disjoint_paths} node-disjoint paths.")
+        if ammount_disjoint_paths >= self.f + 1:
+            if not state.delivered:
+                self.info("Message \"%s\" has been delivered from node %d via %d node-disjoint paths.",
+                          message, origin, ammount_disjoint_paths)
+                self.mark_delivered(state, origin, seq, message)
 
         if len(propagated_to) > 0:
-            print(f"Message propagated to {propagated_to}.")
+            self.debug("Message propagated to %s.", propagated_to)
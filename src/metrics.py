@@ -0,0 +1,115 @@
+import json
+from collections import Counter, deque
+from typing import IO, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class Histogram:
+    """
+    Histogram with power of two buckets, cheap enough to update on every packet.
+    Bucket i counts the values in [2^(i-1), 2^i) microseconds.
+    """
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.buckets: List[int] = [0] * 32
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        micros = int(seconds * 1e6)
+        self.buckets[min(micros.bit_length(), 31)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        # upper bound of the bucket holding the p-th percentile, in seconds
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= rank and amount:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms of one node, plus an optional trace.
+
+    The trace is a ring buffer of (time, event, fields) tuples that keeps only the
+    last trace_size events, so it can stay enabled on long runs. With a size of 0
+    nothing is recorded.
+    """
+
+    def __init__(self, trace_size: int = 0) -> None:
+        self.sent: Counter = Counter()
+        self.bytes_sent: Counter = Counter()
+        # per destination node id, None for peers that are not a node
+        self.bytes_to: Counter = Counter()
+        # datagrams handed to the endpoint, less than sent when packets are coalesced
+        self.datagrams = 0
+        self.received: Counter = Counter()
+        self.handler_latency: Dict[str, Histogram] = {}
+        # name -> (last value, highest value)
+        self.gauges: Dict[str, Tuple[int, int]] = {}
+        # message key -> time, see DistributedAlgorithm.record_broadcast / record_delivery
+        self.broadcasts: Dict[Hashable, float] = {}
+        self.deliveries: Dict[Hashable, float] = {}
+        self.trace: Optional[deque] = deque(maxlen=trace_size) if trace_size else None
+
+    def gauge(self, name: str, value: int) -> None:
+        # queue depths and such, the highest value seen is kept as well
+        last = self.gauges.get(name)
+        self.gauges[name] = (value, value if last is None else max(value, last[1]))
+
+    def latency(self, name: str, seconds: float) -> None:
+        histogram = self.handler_latency.get(name)
+        if histogram is None:
+            histogram = self.handler_latency[name] = Histogram()
+        histogram.add(seconds)
+
+    def event(self, time: float, event: str, *fields) -> None:
+        if self.trace is not None:
+            self.trace.append((time, event, fields))
+
+    def snapshot(self) -> Dict:
+        return {
+            "sent": dict(self.sent),
+            "bytes_sent": dict(self.bytes_sent),
+            "bytes_to": dict(self.bytes_to),
+            "datagrams": self.datagrams,
+            "received": dict(self.received),
+            "handler_latency": {name: histogram.snapshot() for name, histogram in self.handler_latency.items()},
+            "gauges": {name: {"last": last, "max": highest} for name, (last, highest) in self.gauges.items()},
+            "deliveries": len(self.deliveries),
+        }
+
+
+def dump_trace(nodes: Iterable[Tuple[int, Metrics]], out: IO[str]) -> int:
+    """
+    Write the traces of the given (node id, metrics) as JSON lines, ordered by time.
+    Returns the amount of events written.
+    """
+    events = []
+    for node_id, metrics in nodes:
+        if metrics.trace is not None:
+            events.extend((time, node_id, event, fields) for time, event, fields in metrics.trace)
+    events.sort(key=lambda x: (x[0], x[1]))
+    for time, node_id, event, fields in events:
+        out.write(json.dumps({"time": time, "node": node_id, "event": event, "fields": fields}, default=str))
+        out.write("\n")
+    return len(events)
@@ -0,0 +1,150 @@
+from typing import List, Optional
+
+# Paths are bitmasks over node ids: bit i is set when node i is on the path.
+# Subset, disjointness and membership checks become single integer operations.
+
+
+def node_mask(node_id: int) -> int:
+    return 1 << node_id
+
+
+def path_nodes(path: int) -> List[int]:
+    nodes = []
+    while path:
+        lowest = path & -path
+        nodes.append(lowest.bit_length() - 1)
+        path ^= lowest
+    return nodes
+
+
+def path_length(path: int) -> int:
+    return bin(path).count("1")
+
+
+def encode_path(path: int) -> bytes:
+    return path.to_bytes((path.bit_length() + 7) // 8, "little")
+
+
+def decode_path(data: bytes) -> int:
+    return int.from_bytes(data, "little")
+
+
+class PathNodes:
+    """
+    Nodes of a path, only listed when printed. For log messages that are usually turned off.
+    """
+    __slots__ = ("path",)
+
+    def __init__(self, path: int) -> None:
+        self.path = path
+
+    def __str__(self) -> str:
+        return str(path_nodes(self.path))
+
+
+class DisjointPaths:
+    """
+    Incremental count of the node-disjoint paths a broadcast was received over.
+
+    Keeps a largest known set of pairwise node-disjoint paths (capped at `target`).
+    A new path can only grow that set if it is part of the larger set, so on
+    every insert we either append it directly or search the paths that are
+    disjoint from it, instead of re-sorting and rescanning everything.
+
+    Paths that are a superset of a known path are dominated (they can always
+    be swapped for the smaller one) and are neither stored nor reported as new.
+    At most `max_paths` paths are stored, the shortest ones are kept.
+
+    This is not a max-flow over the union of the paths: a flow can combine parts
+    of different paths, and a byzantine node can forge path parts that together
+    avoid it, while every path actually received goes through it. Picking whole
+    paths is set packing, which has no augmenting-path solution, so the search
+    tries the combinations instead. It looks for fewer than `target` paths among
+    at most `max_paths`, which is O(max_paths ^ (target - 1)) checks per insert,
+    polynomial as the target (f + 1) is fixed.
+    """
+
+    def __init__(self, origin: int, destination: int, target: int, max_paths: int = 64) -> None:
+        self.origin = origin
+        self.destination = destination
+        self.target = target
+        self.max_paths = max_paths
+
+        # origin and destination are shared by all paths, so they are masked out
+        self.endpoints = ~(node_mask(origin) | node_mask(destination))
+
+        # all known paths, stored without the origin and destination
+        self.paths: List[int] = []
+        # largest known set of pairwise node-disjoint paths
+        self.disjoint: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.disjoint)
+
+    def add(self, path: int) -> bool:
+        """
+        Register a path, returns False when it is dominated by a known path
+        and therefore not worth relaying.
+        """
+        internal = path & self.endpoints
+
+        # a known path that is a subset of this one makes it useless,
+        # except for the direct path which is disjoint from every other path
+        for other in self.paths:
+            if other & internal == other and (other or not internal):
+                return False
+
+        # enough disjoint paths already, nothing can change the outcome
+        if len(self.disjoint) >= self.target:
+            return True
+
+        amount = len(self.disjoint)
+        replaced = False
+        if internal:
+            # drop the stored paths that this one dominates
+            self.paths = [other for other in self.paths if other & internal != internal]
+            kept = [other for other in self.disjoint if other & internal != internal]
+            if len(kept) < amount:
+                # take the place of the dominated path, the set stays disjoint
+                self.disjoint = kept + [internal]
+                replaced = True
+
+        if not replaced and all(not internal & other for other in self.disjoint):
+            self.disjoint.append(internal)
+        else:
+            # a larger set has to include the new path, so look for as many
+            # disjoint paths as we already had among the ones that avoid it
+            candidates = [other for other in self.paths if not internal & other]
+            found = self._search(candidates, amount)
+            if found is not None:
+                self.disjoint = [internal] + found
+
+        if len(self.paths) >= self.max_paths:
+            # make room by evicting the longest path that is not in use
+            unused = [other for other in self.paths if other not in self.disjoint]
+            longest = max(unused, key=path_length, default=None)
+            if internal not in self.disjoint and (longest is None or path_length(longest) <= path_length(internal)):
+                return True
+            if longest is not None:
+                self.paths.remove(longest)
+
+        self.paths.append(internal)
+        return True
+
+    def clear(self) -> None:
+        self.paths = []
+        self.disjoint = []
+
+    @staticmethod
+    def _search(candidates: List[int], amount: int) -> Optional[List[int]]:
+        # depth is below the target (f + 1), see the class docstring for the bound
+        if amount == 0:
+            return []
+        for i in range(len(candidates) - amount + 1):
+            path = candidates[i]
+            rest = [other for other in candidates[i + 1:] if not path & other]
+            found = DisjointPaths._search(rest, amount - 1)
+            if found is not None:
+                return [path] + found
+        return None
+
@@ -0,0 +1,151 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+
+class Pending:
+    __slots__ = ("item", "sent", "transmissions")
+
+    def __init__(self, item: Any, sent: float) -> None:
+        self.item = item
+        self.sent = sent    # time of the last transmission
+        self.transmissions = 1
+
+
+class ReliableLink:
+    """
+    Sequence numbers, acks and retransmissions of the messages to and from one neighbour.
+
+    Every message sent gets the next sequence number. At most window of them are waiting
+    for an ack, the others are queued until the window has room. An ack holds the lowest
+    sequence number the neighbour is still missing, so it acknowledges everything below it,
+    and the sequence number it was sent for, so messages that arrived after a lost one are
+    not sent again. Three acks in a row for the same missing message send it again right
+    away, otherwise messages are sent again after the retransmission timeout: the round trip
+    time plus four times its variation (RFC 6298), doubled on every timeout. Round trips of
+    messages sent more than once are not measured, their ack can be for either (Karn).
+    After max_retransmits a message is given up, frames hold the lowest sequence number that
+    is still being sent, so the neighbour stops waiting for it.
+    """
+    initial_rto = 1.0
+    min_rto = 0.2
+    max_rto = 30.0
+    # acks for the same missing message after which it is sent again
+    duplicate_acks = 3
+
+    def __init__(self, window: int, max_retransmits: int = 8) -> None:
+        self.window = window
+        self.max_retransmits = max_retransmits
+
+        # sending
+        self.next_seq = 0
+        self.unacked: Dict[int, Pending] = {}
+        self.queue: Deque[Any] = deque()
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = ReliableLink.initial_rto
+        self.last_ack = 0
+        self.duplicates = 0
+        self.retransmits = 0
+
+        # receiving, expected is the lowest sequence number not received yet
+        self.expected = 0
+        self.received: Set[int] = set()
+
+    @property
+    def base(self) -> int:
+        # lowest sequence number that is still being sent
+        return min(self.unacked, default=self.next_seq)
+
+    def send(self, item: Any, now: float) -> List[Tuple[int, Any]]:
+        # (sequence number, item) to transmit now, nothing if the window is full
+        self.queue.append(item)
+        return self._fill(now)
+
+    def _fill(self, now: float) -> List[Tuple[int, Any]]:
+        out = []
+        while self.queue and len(self.unacked) < self.window:
+            item = self.queue.popleft()
+            self.unacked[self.next_seq] = Pending(item, now)
+            out.append((self.next_seq, item))
+            self.next_seq += 1
+        return out
+
+    def ack(self, cumulative: int, seq: int, now: float) -> List[Tuple[int, Any]]:
+        """
+        Apply an ack, returns the (sequence number, item) to transmit now: queued messages
+        that fit the window, or the missing one after enough duplicate acks.
+        """
+        pending = self.unacked.get(seq)
+        if pending is not None and pending.transmissions == 1:
+            self._measure(now - pending.sent)
+
+        acked = [x for x in self.unacked if x < cumulative or x == seq]
+        for x in acked:
+            del self.unacked[x]
+
+        out = []
+        if cumulative > self.last_ack:
+            self.last_ack = cumulative
+            self.duplicates = 0
+        elif cumulative in self.unacked:
+            self.duplicates += 1
+            if self.duplicates == ReliableLink.duplicate_acks:
+                missing = self.unacked[cumulative]
+                missing.sent = now
+                missing.transmissions += 1
+                self.retransmits += 1
+                out.append((cumulative, missing.item))
+        return out + self._fill(now)
+
+    def _measure(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, ReliableLink.min_rto), ReliableLink.max_rto)
+
+    def deadline(self) -> Optional[float]:
+        # time the oldest unacknowledged message is due to be sent again
+        if not self.unacked:
+            return None
+        return min(x.sent for x in self.unacked.values()) + self.rto
+
+    def expire(self, now: float) -> Tuple[List[Tuple[int, Any]], List[Any]]:
+        """
+        The (sequence number, item) to send again as their timeout passed, and the items
+        that were sent max_retransmits times already and are given up.
+        """
+        resend, failed = [], []
+        for seq, pending in list(self.unacked.items()):
+            if pending.sent + self.rto > now:
+                continue
+            if pending.transmissions > self.max_retransmits:
+                del self.unacked[seq]
+                failed.append(pending.item)
+                continue
+            pending.sent = now
+            pending.transmissions += 1
+            resend.append((seq, pending.item))
+        if resend or failed:
+            self.rto = min(self.rto * 2, ReliableLink.max_rto)
+            self.retransmits += len(resend)
+        return resend + self._fill(now), failed
+
+    def receive(self, seq: int, base: int) -> bool:
+        """
+        Note a received frame, with the lowest sequence number its sender still sends.
+        Returns False for a frame that was received before. Afterwards expected is the ack.
+        """
+        if base > self.expected:
+            # the sender gave up on the messages below base
+            self.received = {x for x in self.received if x >= base}
+            self.expected = base
+        if seq < self.expected or seq in self.received:
+            return False
+        self.received.add(seq)
+        while self.expected in self.received:
+            self.received.discard(self.expected)
+            self.expected += 1
+        return True
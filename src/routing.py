@@ -0,0 +1,295 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Routing state is sent as unsigned LEB128 varints, node ids and hop counts
+# are small so most of them take a single byte.
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    if value < 0:
+        raise ValueError("Can not encode negative value %d" % value)
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_ids(ids: Iterable[int]) -> bytes:
+    out = bytearray()
+    for node_id in ids:
+        encode_varint(node_id, out)
+    return bytes(out)
+
+
+def decode_ids(data: bytes) -> List[int]:
+    ids = []
+    offset = 0
+    while offset < len(data):
+        node_id, offset = decode_varint(data, offset)
+        ids.append(node_id)
+    return ids
+
+
+def encode_members(members: Iterable[int], out: Optional[bytearray] = None) -> bytearray:
+    # sorted ids as gaps, decode_adverts adds them up again
+    out = bytearray() if out is None else out
+    previous = 0
+    for member in members:
+        encode_varint(member - previous, out)
+        previous = member
+    return out
+
+
+def mix(value: int) -> int:
+    # 32 bit integer hash, the same on every node (unlike hash())
+    value = ((value >> 16) ^ value) * 0x45d9f3b & 0xffffffff
+    value = ((value >> 16) ^ value) * 0x45d9f3b & 0xffffffff
+    return (value >> 16) ^ value
+
+
+def bloom_bits(node_id: int, bits: int, hashes: int) -> int:
+    # the bits of a node id in a Bloom filter of the given size, by double hashing
+    first = mix(node_id)
+    step = mix(first) | 1
+    mask = 0
+    for i in range(hashes):
+        mask |= 1 << (first + i * step) % bits
+    return mask
+
+
+def bloom(ids: Iterable[int], bits: int, hashes: int) -> int:
+    # Bloom filter of the ids as an int, filters of the same size are merged with |
+    summary = 0
+    for node_id in ids:
+        summary |= bloom_bits(node_id, bits, hashes)
+    return summary
+
+
+def encode_adverts(adverts: Iterable[Tuple[Tuple[int, int], "Advert"]]) -> bytes:
+    """
+    Per advert: level, origin head, version, hops, parent, the amount of members times two
+    (plus one if a summary follows) and the members, then the length and bytes of the summary.
+    Members are sorted and sent as the difference to the one before, which mostly fits a byte.
+    """
+    out = bytearray()
+    for (level, origin), advert in adverts:
+        encode_varint(level, out)
+        encode_varint(origin, out)
+        encode_varint(advert.version, out)
+        encode_varint(advert.hops, out)
+        encode_varint(advert.parent, out)
+        encode_varint(len(advert.members) << 1 | (advert.summary != 0), out)
+        encode_members(advert.members, out)
+        if advert.summary:
+            summary = advert.summary.to_bytes((advert.summary.bit_length() + 7) // 8, "little")
+            encode_varint(len(summary), out)
+            out += summary
+    return bytes(out)
+
+
+def decode_adverts(data: bytes) -> List[Tuple[Tuple[int, int], int, int, int, Tuple[int, ...], int]]:
+    adverts = []
+    offset = 0
+    while offset < len(data):
+        level, offset = decode_varint(data, offset)
+        origin, offset = decode_varint(data, offset)
+        version, offset = decode_varint(data, offset)
+        hops, offset = decode_varint(data, offset)
+        parent, offset = decode_varint(data, offset)
+        count, offset = decode_varint(data, offset)
+        members = []
+        member = 0
+        for _ in range(count >> 1):
+            gap, offset = decode_varint(data, offset)
+            member += gap
+            members.append(member)
+        summary = 0
+        if count & 1:
+            length, offset = decode_varint(data, offset)
+            if offset + length > len(data):
+                raise ValueError("Truncated summary")
+            summary = int.from_bytes(data[offset:offset + length], "little")
+            offset += length
+        adverts.append(((level, origin), version, hops, parent, tuple(members), summary))
+    return adverts
+
+
+class Advert:
+    """
+    Best known advertisement of the members of one cluster head. Heads of level 2 and
+    up list the heads of the clusters one level down that have them as parent, and
+    summarize all nodes of those clusters in a Bloom filter, see bloom().
+    """
+    __slots__ = ("version", "hops", "next_hop", "parent", "members", "summary")
+
+    def __init__(self, version: int, hops: int, next_hop: Optional[int], parent: int, members: Tuple[int, ...],
+                 summary: int = 0) -> None:
+        self.version = version
+        self.hops = hops    # hops to the cluster head, 0 for our own advert
+        self.next_hop = next_hop
+        self.parent = parent    # head of the cluster one level up, the origin itself if it has none
+        self.members = members
+        self.summary = summary    # 0 for level 1, which lists all its members
+
+    def __repr__(self) -> str:
+        if self.summary:
+            return f"v{self.version} {self.hops} hops via {self.next_hop}: {list(self.members)} summary {self.summary:x}"
+        return f"v{self.version} {self.hops} hops via {self.next_hop}: {list(self.members)}"
+
+    def size(self) -> int:
+        # the amount of members, of a summary the amount of bits set
+        return len(self.members) + bin(self.summary).count("1")
+
+    def route(self, origin: int, destination: int) -> Tuple[int, int]:
+        if self.hops == 0:
+            # our own members are direct neighbours, so they are their own next hop
+            return destination, 1
+        if destination == origin:
+            return self.next_hop, self.hops
+        return self.next_hop, self.hops + 1
+
+
+class RoutingTable:
+    """
+    Routing state of a cluster head or gateway.
+
+    Every cluster head originates an advert of its members, versioned with a
+    sequence number it increases whenever the members change. Adverts are kept
+    per (level, origin head), only the newest, and of equally new ones the shortest.
+    apply() tells whether an advert changed anything, so only those have to be
+    passed on. An index destination -> (next hop, hops) holds the route and is
+    updated for the destinations of changed adverts only. Routes go by the lowest
+    level advert that has the destination, only then by the amount of hops.
+
+    Destinations that are only in summaries are not indexed, summary_route() tests
+    them one summary at a time. A summary can hold a destination that is not in
+    the cluster (a false positive), so that route is towards the head of the summary,
+    which can tell.
+    """
+
+    def __init__(self, summary_bits: int = 0, summary_hashes: int = 4) -> None:
+        self.adverts: Dict[Tuple[int, int], Advert] = {}
+        self.routes: Dict[int, Tuple[int, int]] = {}
+        # destination -> (level, origin head) of the adverts that contain it
+        self.origins: Dict[int, Set[Tuple[int, int]]] = {}
+        # size of the summaries, 0 for none
+        self.summary_bits = summary_bits
+        self.summary_hashes = summary_hashes
+        self.summaries: Set[Tuple[int, int]] = set()
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self.adverts
+
+    def __len__(self) -> int:
+        return len(self.adverts)
+
+    def __repr__(self) -> str:
+        return repr(self.adverts)
+
+    def next_hop(self, destination: int) -> Optional[Tuple[int, int]]:
+        return self.routes.get(destination)
+
+    def summary_route(self, destination: int, exclude: Iterable[int] = (),
+                      below: Optional[int] = None) -> Optional[Tuple[int, int, int]]:
+        """
+        (head, next hop, hops) of the lowest level, then nearest, summary that may have the
+        destination, leaving out our own summaries, those of the heads in exclude and,
+        if below is given, those of that level and up.
+        """
+        mask = bloom_bits(destination, self.summary_bits, self.summary_hashes) if self.summary_bits else 0
+        best = None
+        for key in self.summaries:
+            advert = self.adverts[key]
+            if (advert.hops and advert.summary & mask == mask and key[1] not in exclude
+                    and (below is None or key[0] < below)):
+                candidate = (key[0], advert.hops, key[1])
+                if best is None or candidate < best:
+                    best = candidate
+        if best is None:
+            return None
+        return best[2], self.adverts[(best[0], best[2])].next_hop, best[1]
+
+    def encode(self, keys: Optional[Iterable[Tuple[int, int]]] = None) -> bytes:
+        # only the given (level, origin) adverts, or the full table
+        if keys is None:
+            keys = self.adverts.keys()
+        return encode_adverts((key, self.adverts[key]) for key in keys)
+
+    def originate(self, head: int, members: Iterable[int], level: int = 1, parent: Optional[int] = None,
+                  summary: int = 0) -> bool:
+        members = tuple(sorted(members))
+        parent = head if parent is None else parent
+        advert = self.adverts.get((level, head))
+        if advert is not None and (advert.members, advert.parent, advert.summary) == (members, parent, summary):
+            return False
+        version = advert.version + 1 if advert is not None else 1
+        self._replace((level, head), Advert(version, 0, None, parent, members, summary))
+        return True
+
+    def apply(self, next_hop: int, key: Tuple[int, int], version: int, hops: int, parent: int,
+              members: Tuple[int, ...], summary: int = 0) -> bool:
+        """
+        Apply an advert as received from next_hop, returns False if it is not newer or shorter.
+        """
+        advert = self.adverts.get(key)
+        hops += 1
+        if advert is not None:
+            if version < advert.version:
+                return False
+            if version == advert.version and hops >= advert.hops:
+                return False
+        self._replace(key, Advert(version, hops, next_hop, parent, members, summary))
+        return True
+
+    def _replace(self, key: Tuple[int, int], advert: Advert) -> None:
+        old = self.adverts.get(key)
+        self.adverts[key] = advert
+        origin = key[1]
+        if advert.summary:
+            self.summaries.add(key)
+        else:
+            self.summaries.discard(key)
+
+        affected = {origin, *advert.members}
+        if old is not None:
+            affected.update(old.members)
+            for member in old.members:
+                if member not in advert.members:
+                    self.origins[member].discard(key)
+        self.origins.setdefault(origin, set()).add(key)
+        for member in advert.members:
+            self.origins.setdefault(member, set()).add(key)
+
+        for destination in affected:
+            self._reindex(destination)
+
+    def _reindex(self, destination: int) -> None:
+        best = None
+        best_level = None
+        for key in self.origins.get(destination, ()):
+            level, origin = key
+            advert = self.adverts[key]
+            if advert.hops == 0 and (destination == origin or level > 1):
+                # that is us, or the heads of our clusters, which we have the adverts of
+                continue
+            route = advert.route(origin, destination)
+            if best is None or (level, route[1]) < (best_level, best[1]):
+                best, best_level = route, level
+
+        if best is None:
+            self.routes.pop(destination, None)
+        else:
+            self.routes[destination] = best
@@ -1,4 +1,5 @@
 import argparse
+import json
 import yaml
 from asyncio import run
 from ipv8.configuration import ConfigBuilder, default_bootstrap_defs
@@ -6,24 +7,34 @@ from ipv8.util import create_event_with_signals
 from ipv8_service import IPv8
 from algorithms import *
 from dolev import Dolev
+from bracha import BrachaDolev
 from cluster import ClusterHeadAlgorithm
+from simulation import SimulatedEndpoint, run_simulation
+from sharded import run_sharded
+from da_types import LOG_DEBUG, LOG_INFO, LOG_QUIET, LOG_SILENT
+from metrics import dump_trace
 #from src.da_types import DistributedAlgorithm
 
 
+algorithms = {
+    'echo': EchoAlgorithm,
+    'election': RingElection,
+    'dolev': Dolev,
+    'bracha': BrachaDolev,
+    'cluster': ClusterHeadAlgorithm
+}
+
+
 def get_algorithm(name: str) -> DistributedAlgorithm:
-    algorithms = {
-        'echo': EchoAlgorithm,
-        'election': RingElection,
-        'dolev': Dolev,
-        'cluster': ClusterHeadAlgorithm
-    }
     if name not in algorithms.keys():
         raise Exception(f'Cannot find select algorithm with name {name}')
     return algorithms[name]
 
 
-async def start_communities(node_id, connections, algorithm, use_localhost=True) -> None:
-    event = create_event_with_signals()
+async def start_communities(node_id, connections, algorithm, use_localhost=True, event=None) -> DistributedAlgorithm:
+    # many nodes can share a process, then the caller decides when each of them stops
+    if event is None:
+        event = create_event_with_signals()
     base_port = 9090
     connections_updated = [(x, base_port + x) for x in connections]
     node_port = base_port + node_id
@@ -42,26 +53,99 @@ async def start_communities(node_id, connections, algorithm, use_localhost=True)
         builder.finalize(), extra_communities={"DA_Alg_Test": algorithm}
     )
     await ipv8_instance.start()
+    # stopping ipv8 unloads the overlay, so keep it for its metrics
+    overlay = ipv8_instance.get_overlay(algorithm)
     await event.wait()
     await ipv8_instance.stop()
+    return overlay
+
+
+def write_metrics(nodes, trace_file=None, metrics_file=None) -> None:
+    if trace_file:
+        with open(trace_file, "w") as f:
+            amount = dump_trace(((node_id, node.metrics) for node_id, node in nodes.items()), f)
+        print(f"{amount} trace events written to {trace_file}")
+    if metrics_file:
+        with open(metrics_file, "w") as f:
+            json.dump({node_id: node.metrics.snapshot() for node_id, node in nodes.items()}, f, indent=1)
+        print(f"Metrics written to {metrics_file}")
 
 
 if __name__ == "__main__":
+    # in simulation mode all nodes run in this process, so there is no node id to pass
+    simulation = argparse.ArgumentParser(add_help=False)
+    simulation.add_argument("--simulate", type=int, metavar="N", default=None,
+                            help="run nodes 0..N-1 of the topology in this process over an in-memory network")
+    simulation.add_argument("--duration", type=float, default=60.0,
+                            help="(virtual) seconds after which the simulation is stopped")
+    simulation.add_argument("--realtime", action="store_true",
+                            help="simulate in wall clock time instead of virtual time")
+    simulation.add_argument("--seed", type=int, default=None, help="seed for the random delays")
+    simulation.add_argument("--loss", type=float, default=0.0,
+                            help="fraction of the packets the in-memory network drops")
+    simulation.add_argument("--workers", type=int, metavar="W", default=None,
+                            help="run all nodes of the topology on this machine in W processes (0: one per core)")
+    simulate_args, _ = simulation.parse_known_args()
+
     parser = argparse.ArgumentParser(
         prog="Distributed Algorithms",
         description="Code to execute distributed algorithms.",
         epilog="written by Bart Cox (2023)",
+        parents=[simulation],
     )
-    parser.add_argument("node_id", type=int)
+    if simulate_args.simulate is None and simulate_args.workers is None:
+        parser.add_argument("node_id", type=int)
     parser.add_argument("topology", type=str, nargs="?", default="topologies/default.yaml")
     parser.add_argument("algorithm", type=str, nargs="?", default='echo')
     parser.add_argument("-docker", action='store_true')
+    parser.add_argument("-f", type=int, default=None, help="max byzantine nodes (dolev, bracha)")
+    parser.add_argument("--log-level", choices=["silent", "quiet", "info", "debug"], default="debug",
+                        help="silent: nothing, quiet: warnings only, info: outcomes like deliveries, debug: every packet")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="send the packets for the same node from one event loop tick as a single datagram")
+    parser.add_argument("--trace", type=str, metavar="FILE", default=None,
+                        help="write the last --trace-size events of every node to FILE as JSON lines (not with --workers)")
+    parser.add_argument("--trace-size", type=int, default=100000)
+    parser.add_argument("--metrics", type=str, metavar="FILE", default=None,
+                        help="write the counters and handler latencies of every node to FILE as JSON (not with --workers)")
     args = parser.parse_args()
-    node_id = args.node_id
+    if args.workers is not None and (args.trace or args.metrics):
+        # the nodes live in the worker processes, their metrics do not come back
+        parser.error("--trace and --metrics cannot be used with --workers")
 
     alg = get_algorithm(args.algorithm)
+    if args.f is not None:
+        alg.f = args.f
+    if args.seed is not None:
+        alg.seed = args.seed
+    alg.log_level = {"silent": LOG_SILENT, "quiet": LOG_QUIET, "info": LOG_INFO, "debug": LOG_DEBUG}[args.log_level]
+    if args.trace:
+        alg.trace_size = args.trace_size
+    if args.coalesce:
+        alg.coalesce_sends = True
     with open(args.topology, "r") as f:
         topology = yaml.safe_load(f)
-        connections = topology[node_id]
+    if issubclass(alg, ClusterHeadAlgorithm):
+        alg.messages = alg.messages_for(args.topology)
 
-        run(start_communities(node_id, connections, alg, not args.docker))
+    if args.simulate is not None:
+        # connections to nodes outside of the simulated ones are dropped
+        simulated = sorted(topology)[:args.simulate]
+        topology = {node_id: [x for x in topology[node_id] if x in simulated] for node_id in simulated}
+        alg.num_nodes = len(topology)
+        SimulatedEndpoint.loss = args.loss
+        nodes = run_simulation(topology, alg, args.duration, not args.realtime)
+        write_metrics(nodes, args.trace, args.metrics)
+    elif args.workers is not None:
+        alg.num_nodes = len(topology)
+        # traces and metrics stay in the worker processes
+        settings = {"num_nodes": alg.num_nodes, "f": getattr(alg, "f", None), "seed": alg.seed,
+                    "log_level": alg.log_level, "coalesce_sends": alg.coalesce_sends,
+                    "messages": getattr(alg, "messages", None)}
+        run_sharded(topology, alg, {k: v for k, v in settings.items() if v is not None}, args.workers)
+    else:
+        node_id = args.node_id
+        connections = topology[node_id]
+        alg.num_nodes = len(topology)
+        node = run(start_communities(node_id, connections, alg, not args.docker))
+        write_metrics({node_id: node}, args.trace, args.metrics)
@@ -0,0 +1,115 @@
+import os
+import signal
+from asyncio import Event, ensure_future, gather, run
+from multiprocessing import Process
+from typing import Dict, List, Type
+
+from ipv8.util import create_event_with_signals
+
+from da_types import DistributedAlgorithm
+
+
+def partition(topology: Dict[int, List[int]], parts: int) -> List[List[int]]:
+    """
+    Split the nodes into parts of (almost) equal size with few edges between them.
+
+    Greedy graph growing: a part starts at the lowest unassigned node and keeps
+    taking the unassigned node with the most edges into the part, so
+    neighbourhoods end up in the same part. Edges are treated as undirected.
+    """
+    neighbours = {node_id: set() for node_id in topology}
+    for node_id, connections in topology.items():
+        for other in connections:
+            if other in neighbours:
+                neighbours[node_id].add(other)
+                neighbours[other].add(node_id)
+
+    parts = max(1, min(parts, len(topology)))
+    unassigned = set(topology)
+    shards = []
+    for i in range(parts):
+        size = (len(unassigned) + parts - i - 1) // (parts - i)
+        shard = []
+        # unassigned node -> amount of its edges into the current shard
+        frontier: Dict[int, int] = {}
+        while len(shard) < size:
+            if frontier:
+                node_id = max(frontier, key=lambda x: (frontier[x], -x))
+                del frontier[node_id]
+            else:
+                # nothing connected left, start over in another component
+                node_id = min(unassigned)
+            shard.append(node_id)
+            unassigned.remove(node_id)
+            for other in neighbours[node_id]:
+                if other in unassigned:
+                    frontier[other] = frontier.get(other, 0) + 1
+        shards.append(sorted(shard))
+    return shards
+
+
+def cut_edges(topology: Dict[int, List[int]], shards: List[List[int]]) -> int:
+    shard_of = {node_id: i for i, shard in enumerate(shards) for node_id in shard}
+    return sum(
+        1 for node_id, connections in topology.items() for other in connections
+        if other in shard_of and shard_of[node_id] != shard_of[other]
+    )
+
+
+async def run_shard_async(shard: List[int], topology: Dict[int, List[int]], algorithm: Type[DistributedAlgorithm]) -> None:
+    # imported here, as run.py imports this module
+    from run import start_communities
+
+    # every node stops on its own, a signal stops all nodes of the shard
+    events = {node_id: Event() for node_id in shard}
+    interrupted = create_event_with_signals()
+
+    async def forward_signal() -> None:
+        await interrupted.wait()
+        for event in events.values():
+            event.set()
+
+    forward = ensure_future(forward_signal())
+    await gather(*(
+        start_communities(node_id, topology[node_id], algorithm, True, events[node_id]) for node_id in shard
+    ))
+    forward.cancel()
+
+
+def run_shard(
+        shard: List[int], topology: Dict[int, List[int]], algorithm: Type[DistributedAlgorithm], settings: Dict
+) -> None:
+    # class attributes set by run.py do not survive the trip to a spawned worker
+    for name, value in settings.items():
+        setattr(algorithm, name, value)
+    run(run_shard_async(shard, topology, algorithm))
+
+
+def run_sharded(
+        topology: Dict[int, List[int]], algorithm: Type[DistributedAlgorithm], settings: Dict, workers: int = 0
+) -> None:
+    """
+    Run all nodes of the topology on this machine, packed into one process per
+    core (or workers processes), each process running its nodes on one event loop.
+    """
+    workers = workers or os.cpu_count() or 1
+    shards = partition(topology, workers)
+    print(f"Running {len(topology)} nodes in {len(shards)} processes, "
+          f"{cut_edges(topology, shards)} of {sum(len(x) for x in topology.values())} edges between processes")
+
+    processes = [Process(target=run_shard, args=(shard, topology, algorithm, settings)) for shard in shards]
+    for process in processes:
+        process.start()
+
+    # pass a stop request on to the workers, so they can shut their nodes down
+    def forward(signum, _) -> None:
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+
+    for shard, process in zip(shards, processes):
+        process.join()
+        print(f"Nodes {shard} stopped")
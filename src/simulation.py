@@ -0,0 +1,149 @@
+import random
+import selectors
+from asyncio import FIRST_COMPLETED, Event, SelectorEventLoop, ensure_future, gather, get_running_loop, set_event_loop,\
+    wait
+from typing import Dict, List, Optional, Type
+
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.peer import Peer
+from ipv8.peerdiscovery.network import Network
+from ipv8.test.mocking.endpoint import AutoMockEndpoint, internet
+from ipv8.types import Address
+from ipv8.util import create_event_with_signals
+
+from da_types import DistributedAlgorithm
+
+
+class VirtualTimeSelector:
+    """
+    Selector that, instead of blocking until the next timer is due, moves the
+    clock of its loop forward to that timer. Real I/O (signals) is still polled.
+    """
+
+    def __init__(self, loop: "VirtualTimeEventLoop", selector: selectors.BaseSelector) -> None:
+        self.loop = loop
+        self.selector = selector
+
+    def select(self, timeout: Optional[float] = None):
+        if timeout is None:
+            # no timers at all, only real I/O can wake us up
+            return self.selector.select(None)
+        events = self.selector.select(0)
+        if not events and timeout > 0:
+            self.loop.virtual_time += timeout
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+
+class SimulatedEndpoint(AutoMockEndpoint):
+    """
+    In-memory endpoint that delivers packets after a fixed latency instead of
+    right away, so time also passes for algorithms that reply without any delay.
+    """
+
+    # seconds between sending and receiving a packet
+    latency = 0.001
+    # fraction of the packets that is lost on the way
+    loss = 0.0
+
+    def send(self, socket_address: Address, packet: bytes) -> None:
+        if not self.is_open():
+            return
+        if SimulatedEndpoint.loss and random.random() < SimulatedEndpoint.loss:
+            return
+        endpoint = internet.get(socket_address)
+        if endpoint is not None and endpoint.is_open():
+            get_running_loop().call_later(
+                SimulatedEndpoint.latency, endpoint.notify_listeners, (self.wan_address, packet)
+            )
+
+
+class VirtualTimeEventLoop(SelectorEventLoop):
+    """
+    Discrete-event loop: callbacks run in the order of their (virtual) due time,
+    but time only passes when there is nothing left to run, so delays and
+    timeouts cost no wall clock time. Everything scheduled through the loop
+    (asyncio.sleep, call_later, ipv8 tasks) runs on this clock.
+    """
+
+    def __init__(self) -> None:
+        self.virtual_time = 0.0
+        super().__init__(VirtualTimeSelector(self, selectors.DefaultSelector()))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+
+async def simulate(
+        topology: Dict[int, List[int]], algorithm: Type[DistributedAlgorithm], duration: Optional[float] = None
+) -> Dict[int, DistributedAlgorithm]:
+    """
+    Run every node of the topology in this event loop, connected by ipv8's
+    in-memory endpoints instead of UDP sockets. The algorithm classes run
+    unmodified, only the addresses they walk to are the in-memory ones.
+
+    Stops when every node stopped, after duration seconds, or on SIGINT/SIGTERM.
+    """
+    overlays = {}
+    for node_id in topology:
+        endpoint = SimulatedEndpoint()
+        endpoint.open()
+        peer = Peer(default_eccrypto.generate_key("curve25519"), endpoint.wan_address)
+        overlay = algorithm(algorithm.settings_class(my_peer=peer, endpoint=endpoint, network=Network()))
+        overlay.my_estimated_wan = endpoint.wan_address
+        overlay.my_estimated_lan = endpoint.lan_address
+        overlays[node_id] = overlay
+    events = {node_id: Event() for node_id in topology}
+
+    for node_id, overlay in overlays.items():
+        connections = [
+            (other, overlays[other].endpoint.wan_address) for other in topology[node_id] if other in overlays
+        ]
+        await overlay.started(node_id, connections, events[node_id])
+
+    async def run_node(overlay: DistributedAlgorithm, event: Event) -> None:
+        # like a separate process, a node that stops is gone from the network
+        await event.wait()
+        await stop_node(overlay)
+
+    print(f"Simulating {len(overlays)} nodes")
+    interrupted = create_event_with_signals()
+    all_stopped = ensure_future(gather(*(run_node(overlays[node_id], events[node_id]) for node_id in overlays)))
+    on_signal = ensure_future(interrupted.wait())
+    await wait([all_stopped, on_signal], timeout=duration, return_when=FIRST_COMPLETED)
+    all_stopped.cancel()
+    on_signal.cancel()
+    await gather(all_stopped, on_signal, return_exceptions=True)
+
+    for overlay in overlays.values():
+        await stop_node(overlay)
+    return overlays
+
+
+async def stop_node(overlay: DistributedAlgorithm) -> None:
+    if overlay.endpoint.is_open():
+        overlay.endpoint.close()
+        await overlay.unload()
+
+
+def run_simulation(
+        topology: Dict[int, List[int]], algorithm: Type[DistributedAlgorithm], duration: Optional[float] = None,
+        virtual_time: bool = True
+) -> Dict[int, DistributedAlgorithm]:
+    """
+    Run simulate() to completion, on a virtual clock unless virtual_time is False.
+    With a seed set on the algorithm the ipv8 internals are seeded as well,
+    so the same seed gives the same run.
+    """
+    if algorithm.seed is not None:
+        random.seed(algorithm.seed)
+    loop = VirtualTimeEventLoop() if virtual_time else SelectorEventLoop()
+    set_event_loop(loop)
+    try:
+        return loop.run_until_complete(simulate(topology, algorithm, duration))
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        set_event_loop(None)
+        loop.close()
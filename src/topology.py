@@ -0,0 +1,367 @@
+import argparse
+import heapq
+import math
+import random
+import sys
+from collections import deque
+from typing import IO, Dict, Iterable, List, Optional, Set, Tuple
+
+import yaml
+
+# Topologies are adjacency lists, node id -> sorted list of neighbour ids, and are undirected.
+Topology = Dict[int, List[int]]
+
+BASE_PORT = 9090
+# docker nodes get 192.168.55.(10 + node id), see DistributedAlgorithm.started
+MAX_DOCKER_NODES = 245
+
+
+def from_edges(num_nodes: int, edges: Iterable[Tuple[int, int]]) -> Topology:
+    neighbours: List[Set[int]] = [set() for _ in range(num_nodes)]
+    for a, b in edges:
+        if a != b:
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+    return {node_id: sorted(x) for node_id, x in enumerate(neighbours)}
+
+
+def ring(num_nodes: int) -> Topology:
+    # next node first, the ring election starts by sending to the first neighbour
+    return {
+        i: list(dict.fromkeys(x for x in ((i + 1) % num_nodes, (i - 1) % num_nodes) if x != i))
+        for i in range(num_nodes)
+    }
+
+
+def complete(num_nodes: int) -> Topology:
+    return {i: [j for j in range(num_nodes) if j != i] for i in range(num_nodes)}
+
+
+def string(num_nodes: int) -> Topology:
+    return from_edges(num_nodes, ((i, i + 1) for i in range(num_nodes - 1)))
+
+
+def grid(width: int, height: int) -> Topology:
+    edges = []
+    for y in range(height):
+        for x in range(width):
+            node_id = y * width + x
+            if x + 1 < width:
+                edges.append((node_id, node_id + 1))
+            if y + 1 < height:
+                edges.append((node_id, node_id + width))
+    return from_edges(width * height, edges)
+
+
+def regular(num_nodes: int, k: int, rng: random.Random) -> Topology:
+    """
+    Random k-regular graph: starts from the circulant graph in which every node is
+    connected to its k nearest nodes on a ring (k-connected by itself), then mixes it
+    with random degree preserving edge swaps.
+    """
+    if k >= num_nodes or (k * num_nodes) % 2:
+        raise ValueError(f"There is no {k}-regular graph on {num_nodes} nodes")
+    neighbours: List[Set[int]] = [set() for _ in range(num_nodes)]
+    for i in range(num_nodes):
+        for offset in range(1, k // 2 + 1):
+            neighbours[i].add((i + offset) % num_nodes)
+            neighbours[(i + offset) % num_nodes].add(i)
+        if k % 2:
+            neighbours[i].add((i + num_nodes // 2) % num_nodes)
+    edges = [(a, b) for a in range(num_nodes) for b in neighbours[a] if a < b]
+
+    for _ in range(len(edges) * 2):
+        i, j = rng.randrange(len(edges)), rng.randrange(len(edges))
+        a, b = edges[i]
+        c, d = edges[j]
+        # (a, b), (c, d) -> (a, d), (c, b), unless that makes a loop or a double edge
+        if len({a, b, c, d}) < 4 or d in neighbours[a] or b in neighbours[c]:
+            continue
+        neighbours[a].remove(b)
+        neighbours[b].remove(a)
+        neighbours[c].remove(d)
+        neighbours[d].remove(c)
+        neighbours[a].add(d)
+        neighbours[d].add(a)
+        neighbours[c].add(b)
+        neighbours[b].add(c)
+        edges[i], edges[j] = (a, d), (c, b)
+    return {node_id: sorted(x) for node_id, x in enumerate(neighbours)}
+
+
+def erdos_renyi(num_nodes: int, p: float, rng: random.Random) -> Topology:
+    """
+    G(n, p), sampled by skipping over the absent edges (Batagelj & Brandes),
+    so it takes time linear in the amount of edges instead of quadratic in the nodes.
+    """
+    edges = []
+    if p >= 1:
+        return complete(num_nodes)
+    if p <= 0:
+        return from_edges(num_nodes, edges)
+    log_q = math.log(1.0 - p)
+    v, w = 1, -1
+    while v < num_nodes:
+        w += 1 + int(math.log(1.0 - rng.random()) / log_q)
+        while w >= v and v < num_nodes:
+            w -= v
+            v += 1
+        if v < num_nodes:
+            edges.append((v, w))
+    return from_edges(num_nodes, edges)
+
+
+def clustered(clusters: int, size: int, ring_of_clusters: bool = False) -> Tuple[Topology, List[int]]:
+    """
+    Clusters of size nodes, each a star around its head. The last node of a cluster
+    is also connected to the head of the next cluster, making it the gateway between them.
+    Returns the topology and the cluster heads.
+    """
+    if size < 2:
+        raise ValueError("A cluster needs at least a head and one other node")
+    heads = [c * size for c in range(clusters)]
+    edges = []
+    for c, head in enumerate(heads):
+        edges.extend((head, head + i) for i in range(1, size))
+        if c + 1 < clusters or (ring_of_clusters and clusters > 2):
+            edges.append((head + size - 1, heads[(c + 1) % clusters]))
+    return from_edges(clusters * size, edges), heads
+
+
+def disjoint_paths(topology: Topology, source: int, targets: Set[int], limit: int) -> int:
+    """
+    Amount of paths from source to the targets, up to limit, that share no node
+    except source. A single target ends every path, more targets can each end one
+    path only (as if they were all connected to one extra node).
+
+    Unit capacity max-flow on the graph with every node split in an in-node (2v)
+    and an out-node (2v + 1), so node capacities become edge capacities. The search
+    starts at source, so with many targets it stays close to source.
+    """
+    # targets next to the source are a path each, the flow starts with those
+    direct = [x for x in topology[source] if x in targets]
+    if len(direct) >= limit:
+        return len(direct)
+
+    end_capacity = limit if len(targets) == 1 else 1
+    flow: Dict[Tuple[int, int], int] = {}
+    start = 2 * source + 1
+
+    # nodes on a path, only their in-nodes have reverse edges with capacity left
+    used: Set[int] = set()
+
+    def push(path: List[int]) -> None:
+        for a, b in zip(path, path[1:]):
+            flow[(a, b)] = flow.get((a, b), 0) + 1
+            flow[(b, a)] = flow.get((b, a), 0) - 1
+            if b >= 0:
+                used.add(b // 2)
+
+    for target in direct:
+        push([start, 2 * target, -1])
+    paths = len(direct)
+    while paths < limit:
+        # breadth first search for an augmenting path in the residual graph, -1 is past the targets
+        parent = {start: None}
+        queue = deque([start])
+        while queue and -1 not in parent:
+            node = queue.popleft()
+            for nxt, capacity in _residual_edges(topology, source, targets, used, node, end_capacity):
+                if nxt not in parent and capacity - flow.get((node, nxt), 0) > 0:
+                    parent[nxt] = node
+                    if nxt == -1:
+                        break
+                    queue.append(nxt)
+        if -1 not in parent:
+            break
+        path = [-1]
+        while parent[path[-1]] is not None:
+            path.append(parent[path[-1]])
+        push(path[::-1])
+        paths += 1
+    return paths
+
+
+def _residual_edges(topology: Topology, source: int, targets: Set[int], used: Set[int], node: int, end_capacity: int):
+    # (next node, capacity) for the edges out of node in the split graph, reverse edges have capacity 0
+    vertex, out = divmod(node, 2)
+    if out:
+        for other in topology[vertex]:
+            if other != source:
+                yield 2 * other, 1
+        yield node - 1, 0
+        return
+    yield (-1, end_capacity) if vertex in targets else (node + 1, 1)
+    if vertex in used:
+        for other in topology[vertex]:
+            yield 2 * other + 1, 0
+
+
+def vertex_connectivity_at_least(topology: Topology, k: int) -> bool:
+    """
+    Whether at least k nodes have to be removed to disconnect the topology,
+    so that every pair of nodes is connected by k node-disjoint paths (Menger).
+    Dolev delivers over f + 1 of those, and needs 2f + 1 to tolerate f Byzantine nodes.
+
+    Even's algorithm: with the nodes in order v1..vn, check k disjoint paths
+    between each pair of v1..vk, and from each later vj to the set v1..vj-1.
+    Nodes are ordered by the amount of neighbours ordered before them (maximum
+    adjacency), so most vj have k neighbours in that set already and need no
+    flow computation at all.
+    """
+    num_nodes = len(topology)
+    if k <= 0:
+        return True
+    if num_nodes <= k:
+        # only a complete graph of more than k nodes is k-connected
+        return False
+    if min(len(x) for x in topology.values()) < k:
+        return False
+
+    order = []
+    ordered = set()
+    # unordered node -> amount of its neighbours in order, the heap holds (-amount, node)
+    adjacency: Dict[int, int] = {}
+    heap = [(0, min(topology))]
+    while heap:
+        amount, node = heapq.heappop(heap)
+        if node in ordered or -amount != adjacency.get(node, 0):
+            continue
+        order.append(node)
+        ordered.add(node)
+        for other in topology[node]:
+            if other not in ordered:
+                adjacency[other] = adjacency.get(other, 0) + 1
+                heapq.heappush(heap, (-adjacency[other], other))
+    # not everything reached means it is not connected at all
+    if len(order) < num_nodes:
+        return False
+
+    for i in range(k):
+        for j in range(i + 1, k):
+            if disjoint_paths(topology, order[i], {order[j]}, k) < k:
+                return False
+    before = set(order[:k])
+    for j in range(k, num_nodes):
+        if disjoint_paths(topology, order[j], before, k) < k:
+            return False
+        before.add(order[j])
+    return True
+
+
+def write_topology(topology: Topology, out: IO[str], comment: Optional[str] = None) -> None:
+    # same layout as yaml.safe_dump, written node by node
+    if comment:
+        out.write(f"# {comment}\n")
+    for node_id in sorted(topology):
+        out.write(f"{node_id}:\n")
+        out.writelines(f"- {other}\n" for other in topology[node_id])
+
+
+def write_compose(node_ids: Iterable[int], topology_file: str, algorithm: str, template: Dict, out: IO[str]) -> None:
+    """
+    Write the docker-compose file with a service per node, in one pass: the node
+    service of the template is rendered once with placeholders, then filled in per node.
+    """
+    content = dict(template)
+    node = content.pop("services")["node0"]
+    content["x-common-variables"] = dict(content.get("x-common-variables") or {}, TOPOLOGY=topology_file)
+
+    node = dict(node)
+    node["ports"] = ["PORT__:PORT__"]
+    node["networks"] = {"vpcbr": {"ipv4_address": "192.168.55.IP__"}}
+    node["environment"] = dict(node["environment"], PID="PID__", TOPOLOGY=topology_file, ALGORITHM=algorithm)
+    service = yaml.safe_dump({"nodeNODE__": node})
+    service = "".join(f"  {line}\n" for line in service.splitlines())
+    for placeholder in ("NODE__", "PORT__", "IP__", "PID__"):
+        service = service.replace(placeholder, "{" + placeholder.lower() + "}")
+
+    out.write(yaml.safe_dump(content))
+    out.write("services:\n")
+    for node_id in node_ids:
+        out.write(service.format(node__=node_id, port__=BASE_PORT + node_id, ip__=10 + node_id, pid__=node_id))
+
+
+def generate(args: argparse.Namespace) -> Tuple[Topology, Optional[str]]:
+    rng = random.Random(args.seed)
+    if args.family == "ring":
+        return ring(args.num_nodes), None
+    if args.family == "complete":
+        return complete(args.num_nodes), None
+    if args.family == "string":
+        return string(args.num_nodes), None
+    if args.family == "grid":
+        width = args.width or max(1, int(args.num_nodes ** 0.5))
+        return grid(width, args.num_nodes // width), None
+    if args.family == "regular":
+        return regular(args.num_nodes, args.k, rng), None
+    if args.family == "random":
+        # retry until the connectivity asked for is there
+        for _ in range(args.attempts):
+            topology = erdos_renyi(args.num_nodes, args.p, rng)
+            if vertex_connectivity_at_least(topology, args.connectivity):
+                return topology, None
+        raise ValueError(f"No {args.connectivity}-connected G({args.num_nodes}, {args.p}) found "
+                         f"in {args.attempts} attempts, try a higher p")
+    if args.family == "clustered":
+        topology, heads = clustered(args.clusters, args.num_nodes // args.clusters, args.ring_of_clusters)
+        return topology, "cluster heads: " + " ".join(map(str, heads))
+    if args.family == "file":
+        with open(args.topology_file, "r") as f:
+            return {int(k): v for k, v in yaml.safe_load(f).items()}, None
+    raise ValueError(f"Unknown family {args.family}")
+
+
+def main(argv: Optional[List[str]] = None, family: Optional[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="Topology generator",
+        description="Generate a topology and the docker-compose file to run it.",
+    )
+    parser.add_argument("num_nodes", type=int)
+    parser.add_argument("topology_file", type=str, nargs="?", default="topologies/ring.yaml")
+    parser.add_argument("algorithm", type=str, nargs="?", default="echo")
+    parser.add_argument("template_file", type=str, nargs="?", default="docker-compose.template.yml")
+    parser.add_argument("--family", default=family or "ring",
+                        choices=["ring", "complete", "string", "grid", "regular", "random", "clustered", "file"],
+                        help="file: keep the topology file as it is, only write the compose file")
+    parser.add_argument("-k", type=int, default=3, help="degree of the regular family")
+    parser.add_argument("-p", type=float, default=0.1, help="edge probability of the random family")
+    parser.add_argument("--connectivity", type=int, default=0,
+                        help="required vertex connectivity, the random family retries until it has it")
+    parser.add_argument("--attempts", type=int, default=100)
+    parser.add_argument("--clusters", type=int, default=2)
+    parser.add_argument("--ring-of-clusters", action="store_true")
+    parser.add_argument("--width", type=int, default=0, help="width of the grid family, default square")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--compose", type=str, default="docker-compose.yml", help="empty to skip")
+    args = parser.parse_args(argv)
+
+    try:
+        topology, comment = generate(args)
+    except ValueError as e:
+        print(f"\033[31m{e}\033[0m")
+        sys.exit(1)
+
+    if args.connectivity and args.family != "random" and not vertex_connectivity_at_least(topology, args.connectivity):
+        print(f"\033[31mThe topology is not {args.connectivity}-connected\033[0m")
+        sys.exit(1)
+
+    if args.family != "file":
+        with open(args.topology_file, "w") as f:
+            write_topology(topology, f, comment)
+        print(f"Output written to {args.topology_file}")
+
+    if args.compose:
+        if len(topology) > MAX_DOCKER_NODES:
+            print(f"Not writing {args.compose}, the docker network only fits {MAX_DOCKER_NODES} nodes. "
+                  f"Use run.py --workers or --simulate instead.")
+            return
+        with open(args.template_file, "r") as f:
+            template = yaml.safe_load(f)
+        with open(args.compose, "w") as f:
+            write_compose(sorted(topology), args.topology_file, args.algorithm, template, f)
+        print(f"Output written to {args.compose}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules in src import each other by their plain name, as when run from src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
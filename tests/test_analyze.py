@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from analyze import analyze, cached_analyze, elected_heads, load_topology, problems, vertex_connectivity
+from cluster import ClusterHeadAlgorithm
+from topology import complete, from_edges, ring, string
+
+
+def test_load_topology_connects_both_ways(tmp_path):
+    path = tmp_path / "topology.yaml"
+    path.write_text("0:\n- 1\n- 2\n1: []\n2:\n- 2\n")
+    assert load_topology(str(path)) == {0: [1, 2], 1: [0], 2: [0]}
+
+
+def test_vertex_connectivity():
+    assert vertex_connectivity(from_edges(3, [(0, 1)])) == 0
+    assert vertex_connectivity(string(4)) == 1
+    assert vertex_connectivity(ring(7)) == 2
+    assert vertex_connectivity(complete(6)) == 5
+
+
+def test_problems():
+    report = analyze(ring(7))
+    assert report["connectivity"] == 2
+    assert problems(report, "echo", 1) == []
+    assert problems(report, "election", 1) == []
+    # tolerating one byzantine node takes three disjoint paths
+    assert problems(report, "dolev", 0) == []
+    assert problems(report, "dolev", 1) == ["vertex connectivity is 2, tolerating f=1 takes 3"]
+    assert problems(analyze(from_edges(3, [(0, 1)])), "echo", 0) == ["the topology is not connected"]
+
+
+def test_cached_analyze(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    report = cached_analyze(complete(4), cache_dir=cache_dir)
+    assert report == analyze(complete(4))
+    assert len(os.listdir(cache_dir)) == 1
+    # the second time it comes from the cache
+    assert cached_analyze(complete(4), cache_dir=cache_dir) == report
+    assert len(os.listdir(cache_dir)) == 1
+
+
+@pytest.mark.parametrize("name", ["cluster", "cluster_dense", "cluster_disconnected", "many_ch"])
+def test_cluster_messages(name):
+    # the messages meant to arrive have a route, those that should not arrive do not
+    topology_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "topologies", f"{name}.yaml")
+    topology = load_topology(topology_file)
+    members = elected_heads(topology, ClusterHeadAlgorithm.max_cluster_size)
+    messages = ClusterHeadAlgorithm.messages_for(topology_file)
+    report = analyze(topology, sorted(members), [(x.sender, x.destination) for x in messages], members)
+    assert problems(report, "cluster", 0, ["should not arrive" in x.data for x in messages]) == []
+    unreachable = [x for x in report["clusters"]["messages"] if not x[2]]
+    assert len(unreachable) == (3 if name == "cluster_disconnected" else 0)
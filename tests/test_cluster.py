@@ -0,0 +1,85 @@
+import asyncio
+
+from ipv8.keyvault.crypto import default_eccrypto
+from ipv8.peer import Peer
+from ipv8.peerdiscovery.network import Network
+
+from cluster import ClusterHeadAlgorithm, DataMessage, SummaryData
+from routing import encode_ids
+from simulation import SimulatedEndpoint
+
+
+def with_node(node_id, test):
+    # a node that is not started, test(node) calls its handlers directly
+    async def main():
+        endpoint = SimulatedEndpoint()
+        endpoint.open()
+        peer = Peer(default_eccrypto.generate_key("curve25519"), endpoint.wan_address)
+        node = ClusterHeadAlgorithm(
+            ClusterHeadAlgorithm.settings_class(my_peer=peer, endpoint=endpoint, network=Network())
+        )
+        node.node_id = node_id
+        try:
+            test(node)
+        finally:
+            endpoint.close()
+            await node.unload()
+
+    asyncio.run(main())
+
+
+def test_summary_data_delivered_at_destination():
+    def test(node):
+        node.receive_summary_data(SummaryData(9, encode_ids([]), 1, 7, "data"))
+        assert list(node.metrics.deliveries) == [(1, "data")]
+        assert not node.metrics.sent
+
+    with_node(7, test)
+
+
+def test_summary_data_malformed_tried(capsys):
+    def test(node):
+        # a varint that never ends
+        node.receive_summary_data(SummaryData(9, b"\x80", 1, 3, "data"))
+        assert not node.metrics.deliveries
+        assert not node.metrics.sent
+
+    with_node(7, test)
+    assert "Malformed summary data from 1" in capsys.readouterr().out
+
+
+def test_unheard_head_left(monkeypatch):
+    monkeypatch.setattr(ClusterHeadAlgorithm, "levels", 2)
+
+    def test(node):
+        node.level = 1
+        node.originate(1, [])
+        # 9 is the heavier head, 2 hops away, and heads level 2
+        node.routing_table.apply(3, (1, 9), 1, 1, 9, (20, 21))
+        node.routing_table.apply(3, (2, 9), 1, 1, 9, (9,))
+        node.update_hierarchy()
+        assert node.routing_table.adverts[(1, 7)].parent == 9
+
+        # still not listed by 9, so 9 does not get our adverts
+        node.joined[2] -= 2 * ClusterHeadAlgorithm.hierarchy_timeout
+        node.update_hierarchy()
+        assert (2, 9) in node.unheard
+        assert node.routing_table.adverts[(1, 7)].parent == 7
+
+    with_node(7, test)
+
+
+def test_held_until_route_timeout(capsys):
+    def test(node):
+        node.hold(DataMessage(1, 3, "data"))
+        assert len(node.held) == 1
+        node.retry_held()
+        assert len(node.held) == 1
+
+        node.held = [(node.now() - 1, *node.held[0][1:])]
+        node.retry_held()
+        assert not node.held
+        assert not node.metrics.sent
+
+    with_node(7, test)
+    assert "could not find destination 3" in capsys.readouterr().out
@@ -0,0 +1,53 @@
+import io
+import json
+
+from metrics import Histogram, Metrics, dump_trace
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    assert histogram.percentile(50) is None
+    for _ in range(99):
+        histogram.add(0.000003)
+    histogram.add(0.5)
+    # upper bound of the bucket, 3 microseconds is in [2, 4)
+    assert histogram.percentile(50) == 0.000004
+    assert histogram.percentile(99) == 0.000004
+    assert histogram.percentile(100) == 0.5
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["max"] == 0.5
+
+
+def test_histogram_percentile_not_above_max():
+    histogram = Histogram()
+    histogram.add(0.0003)
+    assert histogram.percentile(50) == 0.0003
+
+
+def test_trace_keeps_last_events():
+    metrics = Metrics(trace_size=2)
+    for i in range(3):
+        metrics.event(float(i), "send", i)
+    assert list(metrics.trace) == [(1.0, "send", (1,)), (2.0, "send", (2,))]
+    # without a size nothing is kept
+    metrics = Metrics()
+    metrics.event(0.0, "send")
+    assert metrics.trace is None
+
+
+def test_gauge_keeps_max():
+    metrics = Metrics()
+    metrics.gauge("send_queue", 5)
+    metrics.gauge("send_queue", 2)
+    assert metrics.snapshot()["gauges"] == {"send_queue": {"last": 2, "max": 5}}
+
+
+def test_dump_trace_ordered_by_time():
+    first, second = Metrics(trace_size=10), Metrics(trace_size=10)
+    first.event(2.0, "deliver", (0, "a"))
+    second.event(1.0, "send", "Message", 0, 40)
+    out = io.StringIO()
+    assert dump_trace([(0, first), (1, second)], out) == 2
+    lines = [json.loads(x) for x in out.getvalue().splitlines()]
+    assert [(x["time"], x["node"], x["event"]) for x in lines] == [(1.0, 1, "send"), (2.0, 0, "deliver")]
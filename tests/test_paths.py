@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+from paths import DisjointPaths, decode_path, encode_path, node_mask, path_length, path_nodes
+
+ORIGIN, DESTINATION = 0, 9
+
+
+def mask(*nodes):
+    return sum(node_mask(x) for x in nodes)
+
+
+def most_disjoint(paths):
+    # size of the largest set of pairwise node-disjoint paths, trying every set
+    paths = sorted(set(paths))
+    if not paths:
+        return 0
+    first, rest = paths[0], paths[1:]
+    return max(most_disjoint(rest), 1 + most_disjoint([x for x in rest if not x & first]))
+
+
+@pytest.mark.parametrize("path", [0, 1, 0b1011, 1 << 8, (1 << 200) | 5])
+def test_encode_round_trip(path):
+    assert decode_path(encode_path(path)) == path
+
+
+def test_path_nodes():
+    assert path_nodes(mask(0, 3, 64)) == [0, 3, 64]
+    assert path_length(mask(0, 3, 64)) == 3
+    assert path_nodes(0) == []
+
+
+def test_replace_then_grow():
+    paths = DisjointPaths(ORIGIN, DESTINATION, target=10)
+    assert paths.add(mask(ORIGIN, 1, 2, DESTINATION))
+    # shares node 2, no second disjoint path
+    assert paths.add(mask(ORIGIN, 2, 3, DESTINATION))
+    assert len(paths) == 1
+    # takes the place of 1-2, which leaves room for 2-3 next to it
+    assert paths.add(mask(ORIGIN, 1, DESTINATION))
+    assert len(paths) == 2
+    assert sorted(paths.disjoint) == [mask(1), mask(2, 3)]
+
+
+def test_direct_path():
+    paths = DisjointPaths(ORIGIN, DESTINATION, target=10)
+    assert paths.add(mask(ORIGIN, 1, DESTINATION))
+    # origin to destination itself goes through no other node, so it is disjoint from every path
+    assert paths.add(mask(ORIGIN, DESTINATION))
+    assert len(paths) == 2
+    # and it does not count twice
+    assert not paths.add(mask(ORIGIN, DESTINATION))
+    assert len(paths) == 2
+
+
+def test_dominated():
+    paths = DisjointPaths(ORIGIN, DESTINATION, target=10)
+    assert paths.add(mask(ORIGIN, 1, 2, DESTINATION))
+    # a path through all nodes of a known path, and more, is not relayed
+    assert not paths.add(mask(ORIGIN, 1, 2, 3, DESTINATION))
+    assert not paths.add(mask(ORIGIN, 1, 2, DESTINATION))
+    # a shorter one is, and the longer one is not stored any more
+    assert paths.add(mask(ORIGIN, 2, DESTINATION))
+    assert paths.paths == [mask(2)]
+
+
+def test_target_reached():
+    paths = DisjointPaths(ORIGIN, DESTINATION, target=2)
+    assert paths.add(mask(ORIGIN, 1, DESTINATION))
+    assert paths.add(mask(ORIGIN, 2, DESTINATION))
+    assert len(paths) == 2
+    assert paths.add(mask(ORIGIN, 3, DESTINATION))
+    assert len(paths) == 2
+
+
+def test_max_paths_keeps_shortest():
+    paths = DisjointPaths(ORIGIN, DESTINATION, target=10, max_paths=4)
+    # all through node 1, so only one of them is ever in the disjoint set
+    for other in range(2, 8):
+        assert paths.add(mask(ORIGIN, 1, other, other + 10, DESTINATION))
+    assert len(paths.paths) <= 4
+    assert paths.add(mask(ORIGIN, 1, 30, DESTINATION))
+    assert len(paths.paths) <= 4
+    assert mask(1, 30) in paths.paths
+    # the longest unused path makes room, a longer one than all stored is not kept
+    assert paths.add(mask(ORIGIN, 1, 31, 32, 33, DESTINATION))
+    assert mask(1, 31, 32, 33) not in paths.paths
+    assert len(paths) == 1
+
+
+def test_exact_against_brute_force():
+    rng = random.Random(1)
+    for _ in range(500):
+        paths = DisjointPaths(ORIGIN, DESTINATION, target=10, max_paths=1000)
+        added = []
+        for _ in range(rng.randint(1, 12)):
+            internal = mask(*rng.sample(range(1, 9), rng.randint(0, 3)))
+            added.append(internal)
+            paths.add(internal | mask(ORIGIN, DESTINATION))
+            assert len(paths) == most_disjoint(added)
+            assert all(not a & b for i, a in enumerate(paths.disjoint) for b in paths.disjoint[i + 1:])
@@ -0,0 +1,89 @@
+import pytest
+
+from reliable import ReliableLink
+
+
+def test_window():
+    link = ReliableLink(2)
+    assert link.send("a", 0.0) == [(0, "a")]
+    assert link.send("b", 0.0) == [(1, "b")]
+    # full, queued until the window has room
+    assert link.send("c", 0.0) == []
+    assert link.ack(1, 0, 0.1) == [(2, "c")]
+    assert link.base == 1
+    assert link.ack(3, 2, 0.2) == []
+    assert link.base == 3
+    assert link.deadline() is None
+
+
+def test_rto_from_round_trips():
+    link = ReliableLink(4)
+    assert link.rto == ReliableLink.initial_rto
+    link.send("a", 0.0)
+    link.ack(1, 0, 0.4)
+    # first measurement: rtt + 4 * rtt / 2
+    assert link.srtt == pytest.approx(0.4)
+    assert link.rto == pytest.approx(1.2)
+    link.send("b", 1.0)
+    link.ack(2, 1, 1.4)
+    assert link.rttvar == pytest.approx(0.15)
+    assert link.rto == pytest.approx(1.0)
+    link.send("c", 2.0)
+    link.ack(3, 2, 2.001)
+    assert link.rto >= ReliableLink.min_rto
+
+
+def test_timeout_doubles_rto_and_gives_up():
+    link = ReliableLink(4, max_retransmits=2)
+    link.send("a", 0.0)
+    assert link.deadline() == pytest.approx(1.0)
+    assert link.expire(0.5) == ([], [])
+    assert link.expire(1.0) == ([(0, "a")], [])
+    assert link.rto == pytest.approx(2.0)
+    assert link.expire(3.0) == ([(0, "a")], [])
+    assert link.rto == pytest.approx(4.0)
+    # sent max_retransmits times again, so it is given up
+    assert link.expire(7.0) == ([], ["a"])
+    assert link.deadline() is None
+    assert link.base == link.next_seq == 1
+
+
+def test_no_measurement_of_retransmitted():
+    link = ReliableLink(4)
+    link.send("a", 0.0)
+    link.expire(1.0)
+    # the ack can be for either transmission (Karn)
+    link.ack(1, 0, 1.1)
+    assert link.srtt is None
+    assert link.rto == pytest.approx(2.0)
+
+
+def test_duplicate_acks_retransmit():
+    link = ReliableLink(4)
+    for item in "abcd":
+        link.send(item, 0.0)
+    # 0 got lost, the acks for 1, 2 and 3 all still miss it
+    assert link.ack(0, 1, 0.1) == []
+    assert link.ack(0, 2, 0.1) == []
+    assert link.ack(0, 3, 0.1) == [(0, "a")]
+    assert link.retransmits == 1
+    assert link.ack(0, 3, 0.1) == []
+    assert link.ack(4, 0, 0.2) == []
+    assert link.base == 4
+
+
+def test_receive():
+    link = ReliableLink(4)
+    assert link.receive(0, 0)
+    assert link.receive(2, 0)
+    assert link.expected == 1
+    # duplicates
+    assert not link.receive(0, 0)
+    assert not link.receive(2, 0)
+    assert link.receive(1, 0)
+    assert link.expected == 3
+    # the sender gave up on 3 and 4
+    assert link.receive(6, 5)
+    assert link.expected == 5
+    assert link.receive(5, 5)
+    assert link.expected == 7
@@ -0,0 +1,127 @@
+import pytest
+
+from routing import (
+    Advert, RoutingTable, bloom, bloom_bits, decode_adverts, decode_ids, decode_varint, encode_adverts, encode_ids,
+    encode_varint,
+)
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 16383, 16384, 2 ** 40])
+def test_varint_round_trip(value):
+    out = bytearray()
+    encode_varint(value, out)
+    assert decode_varint(bytes(out), 0) == (value, len(out))
+
+
+def test_varint_size():
+    for value, size in [(0, 1), (127, 1), (128, 2), (16383, 2), (16384, 3)]:
+        out = bytearray()
+        encode_varint(value, out)
+        assert len(out) == size
+
+
+def test_varint_negative():
+    with pytest.raises(ValueError):
+        encode_varint(-1, bytearray())
+
+
+def test_varint_truncated():
+    out = bytearray()
+    encode_varint(300, out)
+    with pytest.raises(ValueError):
+        decode_varint(bytes(out[:-1]), 0)
+
+
+def test_ids_round_trip():
+    ids = [0, 5, 1000, 3, 128]
+    assert decode_ids(encode_ids(ids)) == ids
+    assert decode_ids(b"") == []
+
+
+def test_adverts_round_trip():
+    adverts = [
+        ((1, 4), Advert(3, 2, 7, 4, (1, 2, 300))),
+        ((2, 9), Advert(1, 0, None, 9, ())),
+    ]
+    assert decode_adverts(encode_adverts(adverts)) == [
+        ((1, 4), 3, 2, 4, (1, 2, 300), 0),
+        ((2, 9), 1, 0, 9, (), 0),
+    ]
+
+
+def test_adverts_truncated():
+    data = encode_adverts([((1, 4), Advert(3, 2, 7, 4, (1, 2, 300)))])
+    with pytest.raises(ValueError):
+        decode_adverts(data[:-1])
+
+
+def test_apply_versions():
+    table = RoutingTable()
+    assert table.apply(7, (1, 4), 2, 1, 4, (5, 6))
+    assert table.next_hop(5) == (7, 3)
+
+    # older, or as new but not shorter, changes nothing
+    assert not table.apply(8, (1, 4), 1, 0, 4, (5,))
+    assert not table.apply(8, (1, 4), 2, 1, 4, (5, 6))
+    assert not table.apply(8, (1, 4), 2, 2, 4, (5, 6))
+    assert table.next_hop(5) == (7, 3)
+
+    # as new and shorter
+    assert table.apply(8, (1, 4), 2, 0, 4, (5, 6))
+    assert table.next_hop(5) == (8, 2)
+
+    # newer wins even when longer, members that left lose their route
+    assert table.apply(7, (1, 4), 3, 3, 4, (6,))
+    assert table.next_hop(5) is None
+    assert table.next_hop(6) == (7, 5)
+    assert table.next_hop(4) == (7, 4)
+
+
+def test_originate_versions():
+    table = RoutingTable()
+    assert table.originate(4, [6, 5])
+    assert table.adverts[(1, 4)].version == 1
+    # the same members again is no change
+    assert not table.originate(4, [5, 6])
+    assert table.originate(4, [5])
+    assert table.adverts[(1, 4)].version == 2
+    # our own members are their own next hop
+    assert table.next_hop(5) == (5, 1)
+
+
+def test_bloom_membership():
+    members = range(0, 100, 2)
+    summary = bloom(members, 512, 4)
+    for member in members:
+        mask = bloom_bits(member, 512, 4)
+        assert 0 < bin(mask).count("1") <= 4
+        assert summary & mask == mask
+    # about 1% false positives for 50 ids in 512 bits
+    false_positives = sum(1 for x in range(1000, 3000) if summary & bloom_bits(x, 512, 4) == bloom_bits(x, 512, 4))
+    assert false_positives < 100
+
+
+def test_summary_advert_round_trip():
+    summary = bloom([3, 70, 1000], 256, 4)
+    data = encode_adverts([((2, 9), Advert(4, 1, 3, 12, (), summary))])
+    assert decode_adverts(data) == [((2, 9), 4, 1, 12, (), summary)]
+    with pytest.raises(ValueError):
+        decode_adverts(data[:-1])
+
+
+def test_summary_route():
+    table = RoutingTable(summary_bits=256, summary_hashes=4)
+    assert table.apply(3, (2, 9), 1, 1, 9, (), bloom([70, 71], 256, 4))
+    assert table.apply(5, (2, 8), 1, 0, 8, (), bloom([70], 256, 4))
+    # summaries are not indexed
+    assert table.next_hop(70) is None
+    # (head, next hop, hops), nearest first, leaving out the heads tried already
+    assert table.summary_route(70) == (8, 5, 1)
+    assert table.summary_route(70, exclude=[8]) == (9, 3, 2)
+    assert table.summary_route(70, exclude=[8, 9]) is None
+    assert table.summary_route(71) == (9, 3, 2)
+    # a head looks for the destination in the summaries of the levels below its own
+    assert table.apply(4, (3, 6), 1, 0, 6, (), bloom([70], 256, 4))
+    assert table.summary_route(70, exclude=[8]) == (9, 3, 2)
+    assert table.summary_route(70, exclude=[8, 9]) == (6, 4, 1)
+    assert table.summary_route(70, exclude=[8, 9], below=3) is None
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "run.py")
+
+
+def write_topology(path):
+    path.write_text("0:\n- 1\n1:\n- 0\n")
+    return str(path)
+
+
+def test_metrics_written_by_nodes(tmp_path):
+    # two nodes over localhost, each writes its own metrics once it stopped
+    topology = write_topology(tmp_path / "topology.yaml")
+    nodes = [
+        subprocess.Popen(
+            [sys.executable, RUN, str(node_id), topology, "echo", "--log-level", "quiet",
+             "--metrics", f"metrics{node_id}.json", "--trace", f"trace{node_id}.jsonl"],
+            cwd=tmp_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        for node_id in range(2)
+    ]
+    for node in nodes:
+        output, _ = node.communicate(timeout=60)
+        assert node.returncode == 0, output
+
+    for node_id in range(2):
+        with open(tmp_path / f"metrics{node_id}.json") as f:
+            metrics = json.load(f)[str(node_id)]
+        assert metrics["sent"]["MyMessage"] > 0
+        with open(tmp_path / f"trace{node_id}.jsonl") as f:
+            assert any(json.loads(line)["event"] == "send" for line in f)
+
+
+def test_metrics_written_by_simulation(tmp_path):
+    topology = write_topology(tmp_path / "topology.yaml")
+    result = subprocess.run(
+        [sys.executable, RUN, "--simulate", "2", "--seed", "1", "--duration", "10", topology, "echo",
+         "--log-level", "quiet", "--metrics", "metrics.json"],
+        cwd=tmp_path, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    with open(tmp_path / "metrics.json") as f:
+        assert set(json.load(f)) == {"0", "1"}
+
+
+def test_metrics_rejected_with_workers(tmp_path):
+    topology = write_topology(tmp_path / "topology.yaml")
+    result = subprocess.run(
+        [sys.executable, RUN, "--workers", "1", topology, "echo", "--metrics", "metrics.json"],
+        cwd=tmp_path, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 2
+    assert "--workers" in result.stderr
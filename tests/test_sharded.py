@@ -0,0 +1,28 @@
+from sharded import cut_edges, partition
+from topology import clustered, complete, ring
+
+
+def test_partition_covers_every_node_once():
+    topology = ring(10)
+    shards = partition(topology, 3)
+    assert sorted(x for shard in shards for x in shard) == list(range(10))
+    assert sorted(len(shard) for shard in shards) == [3, 3, 4]
+
+
+def test_partition_keeps_clusters_together():
+    # four clusters of five in a row, only the edges between clusters are cut (both ways)
+    topology, _ = clustered(4, 5)
+    shards = partition(topology, 4)
+    assert shards == [list(range(i, i + 5)) for i in range(0, 20, 5)]
+    assert cut_edges(topology, shards) == 6
+
+
+def test_partition_more_parts_than_nodes():
+    assert partition(ring(3), 8) == [[0], [1], [2]]
+    assert partition(ring(3), 0) == [[0, 1, 2]]
+
+
+def test_cut_edges():
+    topology = complete(4)
+    assert cut_edges(topology, [[0, 1, 2, 3]]) == 0
+    assert cut_edges(topology, [[0, 1], [2, 3]]) == 8
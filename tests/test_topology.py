@@ -0,0 +1,67 @@
+import itertools
+import random
+
+import pytest
+
+from topology import (
+    clustered, complete, disjoint_paths, erdos_renyi, from_edges, grid, regular, ring, string,
+    vertex_connectivity_at_least,
+)
+
+
+def connected(topology, removed):
+    left = [x for x in topology if x not in removed]
+    seen = {left[0]}
+    stack = [left[0]]
+    while stack:
+        for other in topology[stack.pop()]:
+            if other not in removed and other not in seen:
+                seen.add(other)
+                stack.append(other)
+    return len(seen) == len(left)
+
+
+def brute_force_connectivity(topology):
+    # fewest nodes whose removal disconnects the rest, n - 1 for a complete graph
+    num_nodes = len(topology)
+    for k in range(num_nodes - 1):
+        if any(not connected(topology, set(x)) for x in itertools.combinations(topology, k)):
+            return k
+    return num_nodes - 1
+
+
+def test_disjoint_paths():
+    assert disjoint_paths(ring(6), 0, {3}, 5) == 2
+    assert disjoint_paths(complete(5), 0, {1}, 10) == 4
+    # stops at the limit
+    assert disjoint_paths(complete(5), 0, {1}, 2) == 2
+    # more targets end one path each
+    assert disjoint_paths(complete(5), 0, {1, 2}, 10) == 2
+    assert disjoint_paths(grid(3, 3), 0, {8}, 5) == 2
+    assert disjoint_paths(from_edges(3, [(0, 1)]), 0, {2}, 1) == 0
+
+
+@pytest.mark.parametrize("topology, k", [
+    (ring(6), 2),
+    (string(5), 1),
+    (complete(5), 4),
+    (grid(4, 4), 2),
+    (clustered(3, 4)[0], 1),
+    (regular(20, 4, random.Random(1)), 4),
+    # Petersen graph
+    (from_edges(10, [(i, (i + 1) % 5) for i in range(5)] + [(i, i + 5) for i in range(5)]
+                + [(5 + i, 5 + (i + 2) % 5) for i in range(5)]), 3),
+    (from_edges(3, [(0, 1)]), 0),
+])
+def test_vertex_connectivity(topology, k):
+    assert vertex_connectivity_at_least(topology, k)
+    assert not vertex_connectivity_at_least(topology, k + 1)
+
+
+def test_vertex_connectivity_brute_force():
+    rng = random.Random(7)
+    for _ in range(40):
+        topology = erdos_renyi(rng.randint(2, 8), rng.uniform(0.3, 0.9), rng)
+        k = brute_force_connectivity(topology)
+        assert vertex_connectivity_at_least(topology, k)
+        assert not vertex_connectivity_at_least(topology, k + 1)